@@ -9,7 +9,7 @@ import os
 import logging
 import traceback
 import json
-import tomli
+from controller.util import toml_compat
 import gevent
 from gevent.lock import BoundedSemaphore
 import pyvisa
@@ -543,7 +543,7 @@ class Controller():
         """
         config_str = self.get_measurement_program_config_string(username, program)
         if config_str is not None:
-            return tomli.loads(config_str)
+            return toml_compat.loads(config_str)
 
     def set_measurement_program_config(
         self,
@@ -603,7 +603,7 @@ class Controller():
         """
         config_str = self.get_measurement_sweep_config_string(username, sweep)
         if config_str is not None:
-            return tomli.loads(config_str)
+            return toml_compat.loads(config_str)
     
     def set_measurement_sweep_config(self, username, sweep, config):
         """Set measurement program config for user and program."""
@@ -659,8 +659,8 @@ class Controller():
         print("sweep_save_data =", sweep_save_data)
         print("sweep_save_image =", sweep_save_image)
 
-        # verify data folder exists
-        if sweep_save_data and not os.path.exists(data_folder):
+        # verify data folder exists (checked once here, sweeps assume it exists)
+        if sweep_save_data and not os.path.isdir(data_folder):
             logging.error(f"Data folder {data_folder} does not exist. Cancelling measurement sweep.")
             callback(False)
             return
@@ -714,6 +714,13 @@ class Controller():
                     if self.instrument_b1500 is not None:
                         self.instrument_b1500.write("DZ") # ensure channels are zero-d if measurement ran into error
                 
+                # finish any background data file writes
+                try:
+                    MeasurementSweep.wait_io()
+                except Exception as err:
+                    logging.error(f"Measurement data saving FAILED: {err}")
+                    status = False
+
                 # measurement ended (finished or cancelled)
                 if self.instrument_b1500 is not None:
                     logging.info("Measurement finished, turning off SMUs with 'CL' signal")
@@ -825,7 +832,7 @@ class ControllerApiHandler(Resource):
                 return self.signal_measurement_failed(f"Invalid program: {pr}")
             
             try:
-                program_config_dict = tomli.loads(pr_config)
+                program_config_dict = toml_compat.loads(pr_config)
             except Exception as err:
                 logging.error(f"Invalid program config: {err}")
                 return self.signal_measurement_failed(f"Invalid program config for {pr}: {pr_config}")
@@ -842,7 +849,7 @@ class ControllerApiHandler(Resource):
             logging.error(f"Invalid sweep type: {sweep}")
             return self.signal_measurement_failed(f"Invalid sweep: {sweep}")
         try:
-            sweep_config_dict = tomli.loads(sweep_config)
+            sweep_config_dict = toml_compat.loads(sweep_config)
         except Exception as err:
             logging.error(f"Invalid sweep config: {err}")
             return self.signal_measurement_failed("Invalid sweep config")
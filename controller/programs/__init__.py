@@ -3,27 +3,34 @@ Define interface for measurement programs on B1500.
 """
 from __future__ import annotations
 import logging
-import tomli
+import importlib
+from controller.util import toml_compat
 from abc import ABC, abstractmethod
 from enum import Enum, auto
 from typing import Iterator
 # TODO: in future python 3.11, we can import "from typing import Self" for type hint
 
 
-# list of available program names (hardcoded)
-MEASUREMENT_PROGRAMS = [
-    "debug",
-    "debug_multistep",
-    "keysight_id_vds",
-    "keysight_id_vgs",
-    "keysight_id_vds_pulsed_dc",
-    "keysight_id_vgs_pulsed_dc",
-    "keysight_cmos_vout_vin",
-    "keysight_rram_1t1r",
-    "keysight_rram_1t1r_sweep",
-    "keysight_rram_1t1r_sequence",
-    "keysight_iv_2term_sequence",
-]
+# map program name => (module, class name), imported lazily in `MeasurementProgram.get`
+_PROGRAM_CLASSES = {
+    "debug": ("controller.programs.debug", "ProgramDebug"),
+    "debug_multistep": ("controller.programs.debug", "ProgramDebugMultistep"),
+    "keysight_id_vds": ("controller.programs.keysight_fet_iv", "ProgramKeysightIdVds"),
+    "keysight_id_vgs": ("controller.programs.keysight_fet_iv", "ProgramKeysightIdVgs"),
+    "keysight_id_vds_pulsed_dc": ("controller.programs.keysight_fet_iv", "ProgramKeysightIdVdsPulsedDC"),
+    "keysight_id_vgs_pulsed_dc": ("controller.programs.keysight_fet_iv", "ProgramKeysightIdVgsPulsedDC"),
+    "keysight_cmos_vout_vin": ("controller.programs.keysight_cmos", "ProgramKeysightCmosVoutVin"),
+    "keysight_rram_1t1r": ("controller.programs.keysight_rram_1t1r", "ProgramKeysightRram1T1R"),
+    "keysight_rram_1t1r_sweep": ("controller.programs.keysight_rram_1t1r", "ProgramKeysightRram1T1RSweep"),
+    "keysight_rram_1t1r_sequence": ("controller.programs.keysight_rram_1t1r", "ProgramKeysightRram1T1RSequence"),
+    "keysight_iv_2term_sequence": ("controller.programs.keysight_iv2term", "ProgramKeysightIV2TermSequence"),
+}
+
+# list of available program names
+MEASUREMENT_PROGRAMS = list(_PROGRAM_CLASSES.keys())
+
+# cache of program name => imported program class
+_program_cache = {}
 
 class MeasurementResult():
     """Wrapper for measurement result data and status flags."""
@@ -60,7 +67,7 @@ class MeasurementProgram(ABC):
     def default_config(cls) -> dict:
         """Return default `run` arguments config as a dict. Returns and
         parses this class's default config string as toml."""
-        return tomli.loads(cls.default_config_string())
+        return toml_compat.loads(cls.default_config_string())
     
     @staticmethod
     @abstractmethod
@@ -81,44 +88,18 @@ class MeasurementProgram(ABC):
     
     @staticmethod
     def get(name):
-        """Return measurement program class by name."""
+        """Return measurement program class by name.
+        Program modules are imported on first use and cached."""
         s = name.lower()
-        if s == "debug":
-            from controller.programs.debug import ProgramDebug
-            return ProgramDebug
-        if s == "debug_multistep":
-            from controller.programs.debug import ProgramDebugMultistep
-            return ProgramDebugMultistep
-        elif s == "keysight_id_vds":
-            from controller.programs.keysight_fet_iv import ProgramKeysightIdVds
-            return ProgramKeysightIdVds
-        elif s == "keysight_id_vgs":
-            from controller.programs.keysight_fet_iv import ProgramKeysightIdVgs
-            return ProgramKeysightIdVgs
-        elif s == "keysight_id_vds_pulsed_dc":
-            from controller.programs.keysight_fet_iv import ProgramKeysightIdVdsPulsedDC
-            return ProgramKeysightIdVdsPulsedDC
-        elif s == "keysight_id_vgs_pulsed_dc":
-            from controller.programs.keysight_fet_iv import ProgramKeysightIdVgsPulsedDC
-            return ProgramKeysightIdVgsPulsedDC
-        elif s == "keysight_cmos_vout_vin":
-            from controller.programs.keysight_cmos import ProgramKeysightCmosVoutVin
-            return ProgramKeysightCmosVoutVin
-        elif s == "keysight_rram_1t1r":
-            from controller.programs.keysight_rram_1t1r import ProgramKeysightRram1T1R
-            return ProgramKeysightRram1T1R
-        elif s == "keysight_rram_1t1r_sweep":
-            from controller.programs.keysight_rram_1t1r import ProgramKeysightRram1T1RSweep
-            return ProgramKeysightRram1T1RSweep
-        elif s == "keysight_rram_1t1r_sequence":
-            from controller.programs.keysight_rram_1t1r import ProgramKeysightRram1T1RSequence
-            return ProgramKeysightRram1T1RSequence
-        elif s == "keysight_iv_2term_sequence":
-            from controller.programs.keysight_iv2term import ProgramKeysightIV2TermSequence
-            return ProgramKeysightIV2TermSequence
-        else:
-            logging.error(f"Unknown program type: {name}")
-            return None
+        program = _program_cache.get(s)
+        if program is None:
+            if s not in _PROGRAM_CLASSES:
+                logging.error(f"Unknown program type: {name}")
+                return None
+            module_name, class_name = _PROGRAM_CLASSES[s]
+            program = getattr(importlib.import_module(module_name), class_name)
+            _program_cache[s] = program
+        return program
 
 
 # TODO: map sweep_direction to this list
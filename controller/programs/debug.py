@@ -4,7 +4,7 @@ import time
 import numpy as np
 from controller.sse import EventChannel
 from controller.programs import MeasurementProgram, MeasurementResult
-from controller.util import into_sweep_range, dict_np_array_to_json_array, exp_moving_avg_with_init
+from controller.util import into_sweep_range, exp_moving_avg_with_init
 
 
 def start_measurement() -> float:
@@ -181,7 +181,7 @@ class ProgramDebugMultistep(MeasurementProgram):
                         "step": b,
                         "step_total": num_bias,
                     },
-                    "data": dict_np_array_to_json_array(data), # converts np ndarrays to regular lists
+                    "data": data, # np ndarrays serialized directly by channel
                 })
             
             if monitor_channel is not None and b < num_bias-1: # don't publish last step
@@ -59,7 +59,7 @@ from time import time
 from tabulate import tabulate
 from controller.sse import EventChannel
 from controller.programs import MeasurementProgram, MeasurementResult, SweepType
-from controller.util import into_sweep_range, parse_keysight_str_values, iter_chunks, map_smu_to_slot, exp_moving_avg_with_init, dict_np_array_to_json_array
+from controller.util import into_sweep_range, parse_keysight_str_values, iter_chunks, map_smu_to_slot, exp_moving_avg_with_init
 
 
 def measurement_keysight_b1500_setup_cmos(
@@ -623,7 +623,6 @@ class ProgramKeysightCmosVoutVin(MeasurementProgram):
                     if num_inputs == 2:
                         data["v_b"] = v_b_out
                         data["i_a"] = i_b_out
-                    data_cleaned = dict_np_array_to_json_array(data) # converts np ndarrays to regular lists and replace nan
 
                     monitor_channel.publish({
                         "metadata": {
@@ -632,7 +631,7 @@ class ProgramKeysightCmosVoutVin(MeasurementProgram):
                             "step": idx_in_const,
                             "step_total": num_const_points,
                         },
-                        "data": data_cleaned,
+                        "data": data, # np ndarrays serialized directly by channel
                     })
                     
                 gevent.spawn(task_update_program_status)
@@ -25,7 +25,7 @@ from time import time
 from tabulate import tabulate
 from controller.sse import EventChannel
 from controller.programs import MeasurementProgram, MeasurementResult, SweepType
-from controller.util import into_sweep_range, parse_keysight_str_values, iter_chunks, map_smu_to_slot, exp_moving_avg_with_init, dict_np_array_to_json_array
+from controller.util import into_sweep_range, parse_keysight_str_values, iter_chunks, map_smu_to_slot, exp_moving_avg_with_init
 
 
 def measurement_keysight_b1500_setup(
@@ -558,7 +558,6 @@ class ProgramKeysightIdVgs(MeasurementProgram):
                         "time_i_s": time_i_s_out,
                         "time_i_g": time_i_g_out,
                     }
-                    data_cleaned = dict_np_array_to_json_array(data) # converts np ndarrays to regular lists and replace nan
 
                     monitor_channel.publish({
                         "metadata": {
@@ -567,7 +566,7 @@ class ProgramKeysightIdVgs(MeasurementProgram):
                             "step": idx_bias,
                             "step_total": num_bias,
                         },
-                        "data": data_cleaned,
+                        "data": data, # np ndarrays serialized directly by channel
                     })
                     
                 gevent.spawn(task_update_program_status)
@@ -886,7 +885,6 @@ class ProgramKeysightIdVds(MeasurementProgram):
                         "time_i_s": time_i_s_out,
                         "time_i_g": time_i_g_out,
                     }
-                    data_cleaned = dict_np_array_to_json_array(data) # converts np ndarrays to regular lists and replace nan
 
                     monitor_channel.publish({
                         "metadata": {
@@ -895,7 +893,7 @@ class ProgramKeysightIdVds(MeasurementProgram):
                             "step": idx_bias,
                             "step_total": num_bias,
                         },
-                        "data": data_cleaned,
+                        "data": data, # np ndarrays serialized directly by channel
                     })
                     
                 gevent.spawn(task_update_program_status)
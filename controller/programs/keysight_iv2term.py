@@ -9,7 +9,7 @@ from dataclasses import dataclass
 from tabulate import tabulate
 from controller.programs import MeasurementProgram, MeasurementResult, SweepType
 from controller.sse import EventChannel
-from controller.util import into_sweep_range, parse_keysight_str_values, iter_chunks, map_smu_to_slot, dict_np_array_to_json_array, exp_moving_avg_with_init
+from controller.util import into_sweep_range, parse_keysight_str_values, iter_chunks, map_smu_to_slot, exp_moving_avg_with_init
 from controller.util.io import export_hdf5, export_mat
 
 def _query_error(instr_b1500, stop_on_error=True):
@@ -643,7 +643,6 @@ class ProgramKeysightIV2TermSequence(MeasurementProgram):
                         "time_i_b": time_i_b_out,
                         "points": points_out,
                     }
-                    data_cleaned = dict_np_array_to_json_array(data) # converts np ndarrays to regular lists and replace nan
 
                     monitor_channel.publish({
                         "metadata": {
@@ -652,7 +651,7 @@ class ProgramKeysightIV2TermSequence(MeasurementProgram):
                             "step": idx_finished,
                             "step_total": num_sweeps,
                         },
-                        "data": data_cleaned,
+                        "data": data, # np ndarrays serialized directly by channel
                     })
                     
                 gevent.spawn(task_update_program_status)
@@ -61,8 +61,8 @@ from time import time
 from tabulate import tabulate
 from controller.programs import MeasurementProgram, MeasurementResult, SweepType
 from controller.sse import EventChannel
-from controller.util import into_sweep_range, parse_keysight_str_values, iter_chunks, map_smu_to_slot, dict_np_array_to_json_array, exp_moving_avg_with_init
-from controller.util.io import export_hdf5, export_mat
+from controller.util import into_sweep_range, parse_keysight_str_values, iter_chunks, map_smu_to_slot, exp_moving_avg_with_init
+from controller.util.io import export_hdf5, export_mat, write_async
 
 
 class RramSweepConfig():
@@ -480,8 +480,8 @@ def run_rram_1t1r_sweeps(
         if monitor_channel is not None and step < num_sequences-1: # don't publish last step
             def task_update_program_status():
                 """Update program status."""
+                # np ndarrays are serialized directly by monitor channel
                 data_cleaned = calculate_derived_measurement_values(data_measurement)
-                data_cleaned = dict_np_array_to_json_array(data_cleaned) # converts np ndarrays to regular lists and replace nan
 
                 monitor_channel.publish({
                     "metadata": {
@@ -490,7 +490,7 @@ def run_rram_1t1r_sweeps(
                         "step": step,
                         "step_total": num_sequences,
                     },
-                    "data": data_cleaned, 
+                    "data": data_cleaned,
                 })
             gevent.spawn(task_update_program_status)
         
@@ -1193,6 +1193,13 @@ class ProgramKeysightRram1T1RSequence(MeasurementProgram):
             pow_compliance=pow_compliance,
         )
 
+        # check and create save directory once before repetitions
+        if os.path.exists(path_data_folder):
+            path_dir = os.path.join(path_data_folder, path_save_dir)
+            os.makedirs(path_dir, exist_ok=True)
+        else:
+            path_dir = None
+
         for n in range(repeat):
             # create new data block for each reptition
             # common measurement data block format
@@ -1220,16 +1227,15 @@ class ProgramKeysightRram1T1RSequence(MeasurementProgram):
             )
 
             # save data
-            if os.path.exists(path_data_folder):
-                path_dir = os.path.join(path_data_folder, path_save_dir)
-                os.makedirs(path_dir, exist_ok=True)
-
+            if path_dir is not None:
                 program_name = ProgramKeysightRram1T1RSequence.name
                 path_result_h5 = os.path.join(path_dir, f"{program_name}_{n}.h5")
-                path_result_mat = os.path.join(path_dir, f"{program_name}_{n}.mat")
+                # written in background, new data block is created each repetition
+                write_async(export_hdf5, path_result_h5, data_measurement)
                 
-                export_hdf5(path_result_h5, data_measurement)
-                export_mat(path_result_mat, data_measurement)
+                if kwargs.get("export_mat", True): # disable with `export_mat = false`
+                    path_result_mat = os.path.join(path_dir, f"{program_name}_{n}.mat")
+                    write_async(export_mat, path_result_mat, data_measurement)
 
             # show sequence data
             if monitor_channel is not None:
@@ -1238,7 +1244,7 @@ class ProgramKeysightRram1T1RSequence(MeasurementProgram):
                         "program": ProgramKeysightRram1T1RSequence.name,
                         "config": sweep_metadata,
                     },
-                    "data": dict_np_array_to_json_array(data_measurement), # converts np ndarrays to regular lists
+                    "data": data_measurement, # np ndarrays serialized directly by channel
                 })
 
             if signal_cancel is not None and signal_cancel.is_cancelled():
@@ -3,19 +3,114 @@ Flask Server Side Event (SSE) channel implementation:
 https://github.com/singingwolfboy/flask-sse/issues/7
 """
 from typing import Iterator
-import random
-import string
+import secrets
 import json
 import logging
 
 from collections import deque
+from itertools import islice
 from flask import Response, request
-from gevent.queue import Queue
+from gevent.event import Event
 import gevent
 
+import math
+from sys import float_info
+import numpy as np
 
-def generate_id(size=6, chars=string.ascii_lowercase + string.digits):
-    return ''.join(random.choice(chars) for _ in range(size))
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# list element types that never need non-finite float sanitization
+_NO_FLOAT_TYPES = {str, int, bool, type(None)}
+# list element types scanned with `math.isfinite`
+_FLOAT_TYPES = (float, int, np.floating, np.integer)
+
+
+class RawJson(str):
+    """Already serialized json message string, published as is without
+    re-serializing. Must be valid json with non-finite floats already
+    sanitized (e.g. assembled from `json_dumps` outputs)."""
+    pass
+
+def _finite(x) -> float:
+    """Replace a non-finite float with +/- max float."""
+    if x != x: # nan
+        return float_info.max
+    return float_info.max if x > 0 else -float_info.max
+
+def _sanitize(obj):
+    """Replace non-finite floats (NaN, +/-inf are not valid json) with
+    +/- max float, recursing into dicts, lists and tuples. Same as the
+    previous `np.nan_to_num(x, nan=float_info.max)` sanitization, so
+    clients always receive finite numbers. Values are returned as is when
+    nothing needs replacing: numpy arrays and lists of numbers are scanned
+    once (in C), lists of str/int are not walked at all.
+    """
+    if isinstance(obj, dict):
+        # numpy scalar keys (e.g. step index) as python scalars, other
+        # non-str keys (int, float, bool, None) are accepted by both encoders
+        return { (k.item() if isinstance(k, np.generic) else k): _sanitize(v) for k, v in obj.items() }
+    elif isinstance(obj, (list, tuple)):
+        types = set(map(type, obj))
+        if types <= _NO_FLOAT_TYPES:
+            return obj
+        if all(issubclass(t, _FLOAT_TYPES) for t in types):
+            try:
+                if all(map(math.isfinite, obj)):
+                    return obj
+                return [ v if math.isfinite(v) else _finite(v) for v in obj ]
+            except OverflowError: # int too large for float, walk below
+                pass
+        return [ _sanitize(v) for v in obj ]
+    elif isinstance(obj, np.ndarray):
+        if obj.dtype.kind in "fc" and not np.isfinite(obj).all():
+            # upcast float16/32 so max float64 replacement does not overflow
+            if obj.dtype.itemsize < (8 if obj.dtype.kind == "f" else 16):
+                obj = obj.astype(np.float64 if obj.dtype.kind == "f" else np.complex128)
+            return np.nan_to_num(obj, copy=True, nan=float_info.max)
+        return obj
+    elif isinstance(obj, (float, np.floating)):
+        return obj if math.isfinite(obj) else _finite(obj)
+    return obj
+
+def _json_default(obj):
+    """Serialize objects not natively supported by json encoder: numpy
+    arrays (non-contiguous or when `orjson` unavailable) and numpy scalars.
+    """
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    elif isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def json_dumps(message) -> str:
+    """Serialize message into json string for sending to clients. Uses
+    `orjson` if available (which also serializes numpy arrays directly),
+    otherwise falls back to standard `json`. Non-finite floats are replaced
+    with +/- max float (see `_sanitize`). `RawJson` messages are already
+    serialized and passed through, bytes (e.g. posted to debug publish
+    route) are parsed as json, or sent as a json string if not valid json.
+    """
+    if isinstance(message, RawJson):
+        return str.__str__(message)
+    elif isinstance(message, bytes):
+        text = message.decode()
+        try:
+            message = json.loads(text)
+        except ValueError:
+            message = text
+    message = _sanitize(message)
+    if orjson is not None:
+        return orjson.dumps(message, default=_json_default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS).decode()
+    else:
+        return json.dumps(message, default=_json_default, allow_nan=False)
+
+
+def generate_id(size=6):
+    """Return random hex string id of length `size`."""
+    return secrets.token_hex((size + 1) // 2)[:size]
 
 
 class ServerSentEvent(object):
@@ -24,51 +119,123 @@ class ServerSentEvent(object):
         self.data = data
         self.event = event
         self.event_id = generate_id()
-        self.desc_map = {
-            self.data: "data",
-            self.event: "event",
-            self.event_id: "id"
-        }
+        # sequence number in channel history, set by channel when published
+        self.seq = None
+        self._encoded = None
 
-    def encode(self) -> str:
-        """Encodes events as a string."""
-        if not self.data:
-            return ""
-        lines = ["{}: {}".format(name, key)
-                 for key, name in self.desc_map.items() if key]
+    def encode(self) -> bytes:
+        """Encodes events as utf-8 bytes for the response stream. Encoded
+        once and cached, since same event is sent to every subscriber."""
+        if self._encoded is None:
+            if not self.data:
+                s = ""
+            elif self.event:
+                s = f"data: {self.data}\nevent: {self.event}\nid: {self.event_id}\n\n"
+            else:
+                s = f"data: {self.data}\nid: {self.event_id}\n\n"
+            self._encoded = s.encode("utf-8")
+        return self._encoded
 
-        return "{}\n\n".format("\n".join(lines))
+
+class SPSCRing(object):
+    """Fixed capacity single-producer single-consumer ring buffer for
+    passing events from a channel to one subscriber. When full, the oldest
+    item is overwritten, so a slow client drops old events instead of
+    growing memory without bound."""
+    def __init__(self, capacity=256):
+        self.buf = [None] * capacity
+        self.capacity = capacity
+        self.head = 0 # next index to pop
+        self.tail = 0 # next index to push
+        self.size = 0
+        self.dropped = 0 # number of items overwritten before being popped
+        self.ready = Event()
+    
+    def push(self, item) -> bool:
+        """Push item, overwriting oldest item if full (never blocks).
+        Returns True if oldest item was dropped."""
+        self.buf[self.tail] = item
+        self.tail = (self.tail + 1) % self.capacity
+        did_drop = self.size == self.capacity
+        if did_drop: # overwrote oldest
+            self.head = self.tail
+            self.dropped += 1
+        else:
+            self.size += 1
+        self.ready.set()
+        return did_drop
+    
+    def pop(self):
+        """Pop oldest item, cooperatively waiting if empty."""
+        while self.size == 0:
+            self.ready.clear()
+            self.ready.wait()
+        item = self.buf[self.head]
+        self.buf[self.head] = None
+        self.head = (self.head + 1) % self.capacity
+        self.size -= 1
+        return item
 
 
 class EventChannel(object):
-    def __init__(self, history_size=32):
-        self.subscriptions = []
+    def __init__(
+        self,
+        history_size=32,
+        subscriber_size=256,
+        flush_interval=0.005,
+        flush_size=64,
+    ):
+        # each subscriber has a bounded ring buffer of `subscriber_size`
+        # event batches, slow clients drop oldest events when full
+        self.subscriptions = set()
+        self.subscriber_size = subscriber_size
         self.history = deque(maxlen=history_size)
-        self.history.append(ServerSentEvent('start_of_history', None))
+        # map event id => event sequence number in history, so reconnecting
+        # clients can find their last event without scanning history
+        self._seq = 0
+        self._id_to_seq = {}
+        self._append_history(ServerSentEvent('start_of_history', None))
+        # published events waiting to be sent to subscribers. events are
+        # coalesced and flushed as a single batch after `flush_interval`
+        # seconds or once `flush_size` events are pending
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        # single long-lived greenlet sends pending events to subscribers,
+        # woken by `_pending_ready` on publish
+        self._pending = []
+        self._pending_ready = Event()
+        self._notifier = gevent.spawn(self._notify_loop)
 
     def notify(self, message):
-        """Notify all subscribers with message.
+        """Notify all subscribers with message (a list of events).
         Apparently issue occuring with SSE clients not signaling closed 
         properly...so this raises an error when flask backend publishes to
         a closed SSE...
+        Ring buffer pushes never yield, so subscriptions cannot change
+        during this loop and no copy is needed.
         """
-        for sub in self.subscriptions[:]:
-            sub.put(message)
+        for sub in self.subscriptions:
+            if sub.push(message) and sub.dropped == 1:
+                logging.warning("SSE subscriber too slow, dropping oldest events")
 
     def event_generator(self, last_id) -> Iterator[ServerSentEvent]:
         """Yields encoded ServerSentEvents."""
-        q = Queue()
+        q = SPSCRing(capacity=self.subscriber_size)
         self._add_history(q, last_id)
-        self.subscriptions.append(q)
+        self.subscriptions.add(q)
         try:
             while True:
-                yield q.get()
-                gevent.sleep(0.1) # required to prevent blocking thread
+                yield from q.pop()
+                # yield to other greenlets between batches (required to prevent
+                # blocking thread), without fixed delay throttling the stream
+                gevent.sleep(0)
         finally: # should occur after `GeneratorExit` exception
-            self.subscriptions.remove(q)
+            self.subscriptions.discard(q)
+            if q.dropped > 0:
+                logging.warning(f"SSE subscriber closed, dropped {q.dropped} event batches")
 
     def subscribe(self):
-        def gen(last_id) -> Iterator[str]:
+        def gen(last_id) -> Iterator[bytes]:
             for sse in self.event_generator(last_id):
                 yield sse.encode()
         res = Response(
@@ -81,21 +248,54 @@ class EventChannel(object):
 
         return res
     
+    def _append_history(self, sse):
+        """Append event to history and update id => sequence map,
+        removing the id of the event evicted from history (if any)."""
+        if len(self.history) == self.history.maxlen:
+            self._id_to_seq.pop(self.history[0].event_id, None)
+        sse.seq = self._seq
+        self._id_to_seq[sse.event_id] = self._seq
+        self._seq += 1
+        self.history.append(sse)
+
     def _add_history(self, q, last_id):
-        add = False
-        for sse in self.history:
-            if add:
-                q.put(sse)
-            if sse.event_id == last_id:
-                add = True
+        """Replay events after `last_id` to a reconnecting subscriber. The
+        replayed events are pushed as a single batch."""
+        seq = self._id_to_seq.get(last_id)
+        if seq is None:
+            return
+        start = seq - self.history[0].seq + 1
+        batch = list(islice(self.history, start, None))
+        if len(batch) > 0:
+            q.push(batch)
+    
+    def _notify_loop(self):
+        """Notifier greenlet: wait for published events, wait `flush_interval`
+        to coalesce a burst of events, then flush them as one batch."""
+        while True:
+            self._pending_ready.wait()
+            gevent.sleep(self.flush_interval)
+            self._pending_ready.clear()
+            self._flush()
+    
+    def _flush(self):
+        """Send all pending events to subscribers as a single batch."""
+        batch = self._pending
+        self._pending = []
+        if len(batch) > 0:
+            self.notify(batch)
 
     def publish(self, message):
-        # IMPORTANT!: use json.dumps
+        # IMPORTANT!: use json serialization
         # just making a str(message) may use single quotes which
         # cannot be parsed as proper json by client listener
-        sse = ServerSentEvent(json.dumps(message), None)
-        self.history.append(sse)
-        gevent.spawn(self.notify, sse)
+        sse = ServerSentEvent(json_dumps(message), None)
+        self._append_history(sse)
+        self._pending.append(sse)
+        if len(self._pending) >= self.flush_size:
+            self._flush()
+        else:
+            self._pending_ready.set()
 
     def get_last_id(self) -> str:
         return self.history[-1].event_id
\ No newline at end of file
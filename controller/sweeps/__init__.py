@@ -2,25 +2,75 @@
 Define interface for measurement sweeps.
 """
 import logging
+import importlib
 import json
+import copy
 import os
-import tomli
+from pathlib import Path
+import numpy as np
+from controller.util import toml_compat
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
 from controller.programs import MeasurementProgram
-from controller.sse import EventChannel
-from controller.util import timestamp, dict_np_array_to_json_array, SignalCancelTask
-from controller.util.io import export_hdf5, export_mat
+from controller.sse import EventChannel, RawJson, json_dumps
+from controller.util import timestamp, SignalCancelTask
+from controller.util.io import export_json, append_jsonl, export_hdf5, export_hdf5_group, export_mat, write_async, wait_writes
 
 
-# list of available sweep types (hardcoded)
-MEASUREMENT_SWEEPS = [
-    "array",
-    "modules",
-    "multi_die_array",
-    "multi_die_modules",
-    "single",
-]
+# map sweep name => (module, class name), imported lazily in `MeasurementSweep.get`
+_SWEEP_CLASSES = {
+    "array": ("controller.sweeps.array", "SweepArray"),
+    "modules": ("controller.sweeps.modules", "SweepModules"),
+    "multi_die_array": ("controller.sweeps.multi_die_array", "SweepMultiDieArray"),
+    "multi_die_modules": ("controller.sweeps.multi_die_modules", "SweepMultiDieModules"),
+    "single": ("controller.sweeps.single", "SweepSingle"),
+}
+
+# list of available sweep types
+MEASUREMENT_SWEEPS = list(_SWEEP_CLASSES.keys())
+
+# cache of sweep name => imported sweep class, bounded by the fixed set of
+# sweeps in `_SWEEP_CLASSES` (modules are never reloaded while running)
+_sweep_cache = {}
+
+def array_sweep_plan(
+    num_rows: int,
+    num_cols: int,
+    initial_device_row: int,
+    initial_device_col: int,
+    device_dx: float,
+    device_dy: float,
+    sweep_order: str = "row",
+    serpentine: bool = False,
+):
+    """Precompute device traversal order for an array sweep. Returns flat
+    lists `(rows, cols, xs, ys)` of device (row, col) in measurement order
+    and chuck (x, y) position of each device relative to chuck home
+    (the initial device).
+    - sweep_order = "row": Sweep cols in row, then change row.
+    - sweep_order = "col": Sweep rows in col, then change col.
+    - serpentine: reverse every other row (or col) so chuck snakes back
+      instead of returning to col 0 (or row 0), shortening chuck travel.
+    Raises ValueError for an invalid `sweep_order`.
+    """
+    ny, nx = np.meshgrid(np.arange(num_rows), np.arange(num_cols), indexing="ij")
+    if sweep_order == "col":
+        ny, nx = ny.T, nx.T
+    elif sweep_order != "row":
+        raise ValueError(f"Invalid sweep_order {sweep_order}, must be 'row' or 'col'")
+    if serpentine:
+        ny = ny.copy()
+        nx = nx.copy()
+        ny[1::2] = ny[1::2, ::-1]
+        nx[1::2] = nx[1::2, ::-1]
+    ny = ny.ravel()
+    nx = nx.ravel()
+    return (
+        (initial_device_row + ny).tolist(),
+        (initial_device_col + nx).tolist(),
+        (nx * device_dx).tolist(),
+        (ny * device_dy).tolist(),
+    )
 
 @dataclass
 class RunMeasurementProgram:
@@ -33,6 +83,15 @@ class RunMeasurementProgram:
 
     def __post_init__(self):
         self.name = self.program.name # for convenience
+        # .mat copy of result is saved by default, disable with
+        # `export_mat = false` in program config (.h5 result only)
+        self.export_mat = bool(self.config.get("export_mat", True))
+        # program entry in sweep metadata, constant for whole sweep
+        self.metadata = {
+            "name": self.name,
+            "config": self.config_string,
+            "formats": ["h5", "mat"] if self.export_mat else ["h5"],
+        }
 
 class MeasurementSweep(ABC):
     """Interface for measurement sweeps."""
@@ -42,26 +101,18 @@ class MeasurementSweep(ABC):
 
     @staticmethod
     def get(name):
-        """Get measurement sweep class implementation by name."""
+        """Get measurement sweep class implementation by name.
+        Sweep modules are imported on first use and cached."""
         s = name.lower()
-        if s == "array":
-            from controller.sweeps.array import SweepArray
-            return SweepArray
-        elif s == "modules":
-            from controller.sweeps.modules import SweepModules
-            return SweepModules
-        elif s == "multi_die_array":
-            from controller.sweeps.multi_die_array import SweepMultiDieArray
-            return SweepMultiDieArray
-        elif s == "multi_die_modules":
-            from controller.sweeps.multi_die_modules import SweepMultiDieModules
-            return SweepMultiDieModules
-        elif s == "single":
-            from controller.sweeps.single import SweepSingle
-            return SweepSingle
-        else:
-            logging.error(f"Unknown sweep type: {name}")
-            return None
+        sweep = _sweep_cache.get(s)
+        if sweep is None:
+            if s not in _SWEEP_CLASSES:
+                logging.error(f"Unknown sweep type: {name}")
+                return None
+            module_name, class_name = _SWEEP_CLASSES[s]
+            sweep = getattr(importlib.import_module(module_name), class_name)
+            _sweep_cache[s] = sweep
+        return sweep
     
     @staticmethod
     def metadata(
@@ -79,6 +130,10 @@ class MeasurementSweep(ABC):
         data_folder,
         programs,
     ):
+        """Return sweep metadata as a plain dict. This is passed to programs
+        as `sweep_metadata` and directly serialized to json for `meta.json`
+        and monitor updates, so keep as dict literal (fastest to build).
+        """
         return {
             "timestamp": timestamp(),
             "user": user,
@@ -110,12 +165,16 @@ class MeasurementSweep(ABC):
         device_dx: float,
         device_dy: float,
         data_folder: str,
-        save_dir: str,
+        sweep_save_dir: str,
         save_data: bool,
         programs: list[RunMeasurementProgram],
     ) -> dict:
-        """Save metadata `meta.json` file to save directory.
-        Returns the metadata dict object.
+        """Save sweep metadata `meta.json` file once per sweep into
+        `sweep_save_dir`, called before the sweep loop starts. Each measured
+        device is then appended to `devices.jsonl` in the same directory by
+        `save_device_metadata`. This creates the sweep save directory,
+        `data_folder` existence is checked once by controller before the
+        sweep starts. Returns the metadata dict object.
         """
         sweep_metadata = MeasurementSweep.metadata(
             user=user,
@@ -130,19 +189,87 @@ class MeasurementSweep(ABC):
             device_dx=device_dx,
             device_dy=device_dy,
             data_folder=data_folder,
-            programs=[ {"name": p.name, "config": p.config_string} for p in programs ],
+            programs=[ p.metadata for p in programs ],
         )
         
-        if save_data and os.path.exists(data_folder):
-            path_dir = os.path.join(data_folder, save_dir)
-            os.makedirs(path_dir, exist_ok=True)
+        if save_data:
+            path_dir = os.path.join(data_folder, sweep_save_dir)
+            try:
+                # Path.mkdir tries mkdir first, only creating parents on error
+                # (makedirs always stats parent first)
+                Path(path_dir).mkdir(parents=True, exist_ok=True)
+            except OSError as err:
+                logging.error(f"Failed to create save directory {path_dir}: {err}")
+                return sweep_metadata
 
             path_meta = os.path.join(path_dir, "meta.json")
             
-            with open(path_meta, "w+") as f:
-                json.dump(sweep_metadata, f, indent=2)
+            write_async(export_json, path_meta, sweep_metadata)
         
         return sweep_metadata
+    
+    @staticmethod
+    def save_device_metadata(
+        data_folder: str,
+        sweep_save_dir: str,
+        save_dir: str,
+        save_data: bool,
+        programs: list[RunMeasurementProgram],
+        t_measurement: str = None,
+        save_single_file: bool = False,
+        **device,
+    ):
+        """Create device save directory `save_dir` and append a line for the
+        device to the sweep `devices.jsonl` file. `device` keyword args are
+        the device location (e.g. `row`, `col`, `row_col_str`, `module`,
+        `die_x`, `die_y`), written into the line along with the device
+        `save_dir` (relative to `data_folder`), timestamp and program names.
+        `t_measurement` is the device timestamp used in `save_dir` name.
+        The same device metadata plus `sweep_save_dir` is also written to a
+        small `meta.json` in the device directory, pointing to the sweep
+        `meta.json` (full metadata is the sweep metadata joined with this).
+        If `save_single_file`, results go into the sweep `sweep.h5` file
+        (group named `save_dir`) so the device directory is not created.
+
+        The `devices.jsonl` line is appended directly in the calling sweep
+        greenlet (not on the write threads) so lines stay in measurement
+        order.
+        """
+        if not save_data:
+            return
+        
+        if not save_single_file:
+            path_dir = os.path.join(data_folder, save_dir)
+            try:
+                Path(path_dir).mkdir(parents=True, exist_ok=True)
+            except OSError as err:
+                logging.error(f"Failed to create save directory {path_dir}: {err}")
+                return
+        
+        path_devices = os.path.join(data_folder, sweep_save_dir, "devices.jsonl")
+        device_metadata = {
+            **device,
+            "save_dir": save_dir,
+            "timestamp": t_measurement if t_measurement is not None else timestamp(),
+            "programs": [ p.name for p in programs ],
+        }
+
+        # single small append, write threads could reorder lines
+        try:
+            append_jsonl(path_devices, device_metadata)
+        except OSError as err:
+            logging.error(f"Failed to append device metadata to {path_devices}: {err}")
+        
+        if not save_single_file:
+            path_meta = os.path.join(path_dir, "meta.json")
+            write_async(export_json, path_meta, { **device_metadata, "sweep_save_dir": sweep_save_dir })
+
+    @staticmethod
+    def wait_io():
+        """Block until all background metadata and result data file writes
+        are finished. Called after a sweep finishes. Raises `RuntimeError`
+        if any background write failed."""
+        wait_writes()
 
     @staticmethod
     def run_single(
@@ -154,6 +281,9 @@ class MeasurementSweep(ABC):
         save_dir: str,
         save_data: bool,
         program: RunMeasurementProgram,
+        sweep_save_dir: str = None,
+        save_single_file: bool = False,
+        sweep_metadata_json: str = None,
     ):
         """Standard internal method to run a program sweep on a single device
         inside a 2D array of devices. This method used internally by array sweep
@@ -167,7 +297,21 @@ class MeasurementSweep(ABC):
         - `sweep_metadata`: Copy of sweep metadata dict
         - `path_data_folder`: Path to overall sweep data folder, for programs that do continuous data saving
         - `path_save_dir`: Path to sweep specific data folder, for programs that do continuous data saving
+
+        After the measurement, result files are queued to the background
+        write threads (`write_async`) and the result is published, then this
+        returns immediately so the next measurement overlaps the file writes.
+        Queued writes are joined once after the sweep by `wait_io`.
+
+        If `save_single_file`, the .h5 result is written into group
+        `{save_dir}/{program name}` of `sweep.h5` in `sweep_save_dir`
+        instead of a separate .h5 file in the device save directory.
+
+        `sweep_metadata_json` is `sweep_metadata` serialized once by the
+        sweep `run` (constant for whole sweep), serialized here if None.
         """
+        program_name = program.name
+
         result = program.program.run(
             instr_b1500=instr_b1500,
             monitor_channel=monitor_channel,
@@ -178,25 +322,32 @@ class MeasurementSweep(ABC):
             **program.config,
         )
         
-        if save_data and result.save_data and os.path.exists(data_folder):
+        # save directory already created by `save_device_metadata`
+        if save_data and result.save_data:
             path_dir = os.path.join(data_folder, save_dir)
-            os.makedirs(path_dir, exist_ok=True)
-
-            path_result_h5 = os.path.join(path_dir, f"{program.name}.h5")
-            path_result_mat = os.path.join(path_dir, f"{program.name}.mat")
-            
-            export_hdf5(path_result_h5, result.data)
-            export_mat(path_result_mat, result.data)
+            if save_single_file:
+                path_sweep_h5 = os.path.join(data_folder, sweep_save_dir, "sweep.h5")
+                write_async(export_hdf5_group, path_sweep_h5, f"{save_dir}/{program_name}", result.data)
+            else:
+                path_result_h5 = os.path.join(path_dir, f"{program_name}.h5")
+                write_async(export_hdf5, path_result_h5, result.data)
+            # .h5 and .mat are separate write tasks, so the two files are
+            # written in parallel by the write threads
+            if program.export_mat:
+                if save_single_file:
+                    # device directory only needed for .mat file
+                    Path(path_dir).mkdir(parents=True, exist_ok=True)
+                write_async(export_mat, os.path.join(path_dir, f"{program_name}.mat"), result.data)
         
         # broadcast metadata and data
         if monitor_channel is not None:
-            monitor_channel.publish({
-                "metadata": {
-                    "program": program.name,
-                    "config": sweep_metadata,
-                },
-                "data": dict_np_array_to_json_array(result.data), # converts np ndarrays to regular lists
-            })
+            # message json assembled from pre-serialized sweep metadata, same as
+            # {"metadata": {"program": ..., "config": sweep_metadata}, "data": ...}
+            # np ndarrays in data are serialized directly by `json_dumps`
+            metadata_json = sweep_metadata_json if sweep_metadata_json is not None else json_dumps(sweep_metadata)
+            monitor_channel.publish(RawJson(
+                f'{{"metadata":{{"program":{json.dumps(program_name)},"config":{metadata_json}}},"data":{json_dumps(result.data)}}}'
+            ))
 
     @staticmethod
     @abstractmethod
@@ -204,10 +355,18 @@ class MeasurementSweep(ABC):
         """Return default `sweep_config` arguments config as a toml string."""
         return ""
     
-    def default_config(self) -> dict:
-        """Return default `sweep_config` arguments config as a dict. Returns and
-        parses this class's default config string as toml."""
-        return tomli.loads(self.__class__.default_config_string())
+    @classmethod
+    def default_config(cls) -> dict:
+        """Return default `sweep_config` arguments config as a dict. Parses
+        this class's default config string as toml once and caches it, returns
+        a copy so callers can modify it. Default config string is a constant
+        in code (not a file), so cache is one dict per sweep class and never
+        needs invalidating."""
+        config = cls.__dict__.get("_default_config")
+        if config is None:
+            config = toml_compat.loads(cls.default_config_string())
+            cls._default_config = config
+        return copy.deepcopy(config)
     
     @staticmethod
     @abstractmethod
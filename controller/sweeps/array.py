@@ -1,7 +1,8 @@
 import logging
 import gevent
-from controller.sweeps import MeasurementSweep
-from controller.util import timestamp
+from controller.sse import json_dumps
+from controller.sweeps import MeasurementSweep, array_sweep_plan
+from controller.util import timestamp, SignalCancelTask
 
 class SweepArray(MeasurementSweep):
     """Implement an array sweep."""
@@ -20,6 +21,8 @@ class SweepArray(MeasurementSweep):
             num_rows = 1
             num_cols = 1
             sweep_order = "row"
+            serpentine = false
+            save_single_file = false
             programs = []
         """
     
@@ -44,11 +47,54 @@ class SweepArray(MeasurementSweep):
         signal_cancel=None,
     ):
         """Run the sweep."""
+        if signal_cancel is None:
+            signal_cancel = SignalCancelTask.never()
+        # bound once, checked after every device
+        is_cancelled = signal_cancel.is_cancelled
 
         # unpack config
         num_rows = sweep_config["num_rows"]
         num_cols = sweep_config["num_cols"]
         sweep_order = sweep_config["sweep_order"]
+        serpentine = sweep_config.get("serpentine", False)
+        # save all device results in one `sweep.h5` instead of file per device
+        save_single_file = sweep_config.get("save_single_file", False)
+
+        # precompute device order and chuck positions (relative to home)
+        rows, cols, xs, ys = array_sweep_plan(
+            num_rows=num_rows,
+            num_cols=num_cols,
+            initial_device_row=initial_device_row,
+            initial_device_col=initial_device_col,
+            device_dx=device_dx,
+            device_dy=device_dy,
+            sweep_order=sweep_order,
+            serpentine=serpentine,
+        )
+        row_col_format = "r{row}_c{col}" if sweep_order == "row" else "c{col}_r{row}"
+
+        # sweep metadata saved once before sweep into `sweep_save_dir`,
+        # each measured device is appended to its `devices.jsonl`
+        sweep_save_dir = f"sweep_{timestamp()}"
+        sweep_metadata = MeasurementSweep.save_metadata(
+            user=user,
+            sweep_name=SweepArray.name,
+            sweep_config_string=sweep_config_string,
+            initial_die_x=initial_die_x,
+            initial_die_y=initial_die_y,
+            die_dx=die_dx,
+            die_dy=die_dy,
+            initial_device_row=initial_device_row,
+            initial_device_col=initial_device_col,
+            device_dx=device_dx,
+            device_dy=device_dy,
+            data_folder=data_folder,
+            sweep_save_dir=sweep_save_dir,
+            save_data=sweep_save_data,
+            programs=programs,
+        )
+        # serialized once, reused by all monitor updates in this sweep
+        sweep_metadata_json = json_dumps(sweep_metadata)
 
         # create closure here to simplify passing arguments
         def run_inner(row, col, row_col_str):
@@ -60,22 +106,15 @@ class SweepArray(MeasurementSweep):
             t_measurement = timestamp()
             save_dir = f"gax_{row_col_str}_{t_measurement}"
 
-            sweep_metadata = MeasurementSweep.save_metadata(
-                user=user,
-                sweep_name=SweepArray.name,
-                sweep_config_string=sweep_config_string,
-                initial_die_x=initial_die_x,
-                initial_die_y=initial_die_y,
-                die_dx=die_dx,
-                die_dy=die_dy,
-                initial_device_row=initial_device_row,
-                initial_device_col=initial_device_col,
-                device_dx=device_dx,
-                device_dy=device_dy,
+            MeasurementSweep.save_device_metadata(
                 data_folder=data_folder,
+                sweep_save_dir=sweep_save_dir,
                 save_dir=save_dir,
                 save_data=sweep_save_data,
                 programs=programs,
+                t_measurement=t_measurement,
+                save_single_file=save_single_file,
+                row=row, col=col, row_col_str=row_col_str,
             )
 
             for pr in programs:
@@ -85,47 +124,27 @@ class SweepArray(MeasurementSweep):
                     monitor_channel=monitor_channel,
                     signal_cancel=signal_cancel,
                     sweep_metadata=sweep_metadata,
+                    sweep_metadata_json=sweep_metadata_json,
                     data_folder=data_folder,
                     save_dir=save_dir,
                     save_data=sweep_save_data,
                     program=pr,
+                    sweep_save_dir=sweep_save_dir,
+                    save_single_file=save_single_file,
                 )
 
-                # yields thread for other tasks (so data gets pushed)
-                # TODO: proper multithreaded task
-                gevent.sleep(0.3)
-            
-            # yields thread for other tasks
-            # TODO: proper multithreaded task
-            gevent.sleep(0.3)
+                # yield to other tasks (so data gets pushed), no delay needed since
+                # file writes and monitor publish do not block
+                gevent.sleep(0)
 
-        if sweep_order == "row":
-            for ny, row in enumerate(range(initial_device_row, initial_device_row + num_rows)):
-                for nx, col in enumerate(range(initial_device_col, initial_device_col + num_cols)):
-                    run_inner(row, col, row_col_str=f"r{row}_c{col}")
-                    # check cancel signal and return if received
-                    if signal_cancel is not None and signal_cancel.is_cancelled():
-                        logging.info("Measurement cancelled by signal.")
-                        return
-                    # move chuck by 1 col
-                    if nx < (num_cols-1) and instr_cascade is not None:
-                        instr_cascade.move_chuck_relative_to_home(x=(nx+1)*device_dx, y=ny*device_dy)
-                # move chuck back to col 0, move up by 1 row
-                if ny < (num_rows-1) and instr_cascade is not None:
-                    instr_cascade.move_chuck_relative_to_home(x=0, y=(ny+1)*device_dy)
-        elif sweep_order == "col":
-            for nx, col in enumerate(range(initial_device_col, initial_device_col + num_cols)):
-                for ny, row in enumerate(range(initial_device_row, initial_device_row + num_rows)):
-                    run_inner(row, col, row_col_str=f"c{col}_r{row}")
-                    # check cancel signal and return if received
-                    if signal_cancel is not None and signal_cancel.is_cancelled():
-                        logging.info("Measurement cancelled by signal.")
-                        return
-                    # move chuck by 1 row
-                    if ny < (num_rows-1) and instr_cascade is not None:
-                        instr_cascade.move_chuck_relative_to_home(x=nx*device_dx, y=(ny+1)*device_dy)
-                # move chuck back to row 0, move by 1 col
-                if nx < (num_cols-1) and instr_cascade is not None:
-                    instr_cascade.move_chuck_relative_to_home(x=(nx+1)*device_dx, y=0)
-        else:
-            raise ValueError(f"Invalid sweep_order {sweep_order}, must be 'row' or 'col'")
+        for k in range(len(rows)):
+            row = rows[k]
+            col = cols[k]
+            # move chuck to device (first device is at chuck home)
+            if k > 0 and instr_cascade is not None:
+                instr_cascade.move_chuck_relative_to_home(x=xs[k], y=ys[k])
+            run_inner(row, col, row_col_str=row_col_format.format(row=row, col=col))
+            # check cancel signal and return if received
+            if is_cancelled():
+                logging.info("Measurement cancelled by signal.")
+                return
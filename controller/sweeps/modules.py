@@ -3,22 +3,22 @@ Sweep by modules.
 """
 import logging
 import gevent
+from controller.util import toml_compat
+from controller.sse import json_dumps
 from controller.sweeps import MeasurementSweep
-from controller.util import timestamp
+from controller.util import timestamp, SignalCancelTask
 
 
 def load_modules_from_toml(modules_file: str) -> dict:
     """Load modules dictionary from TOML file."""
-    import tomli
     with open(modules_file, "rb") as f:
-        toml = tomli.load(f)
+        toml = toml_compat.load(f)
     return toml["modules"]
 
 def load_sweep_from_toml(sweep_file: str) -> list:
     """Load modules sweep list from TOML file."""
-    import tomli
     with open(sweep_file, "rb") as f:
-        toml = tomli.load(f)
+        toml = toml_compat.load(f)
     return toml["sweep"]
 
 class SweepModules(MeasurementSweep):
@@ -68,6 +68,10 @@ class SweepModules(MeasurementSweep):
         signal_cancel=None,
     ):
         """Run the sweep."""
+        if signal_cancel is None:
+            signal_cancel = SignalCancelTask.never()
+        # bound once, checked after every device
+        is_cancelled = signal_cancel.is_cancelled
 
         # unpack config
         if sweep_config.get("modules_file") is not None:
@@ -83,6 +87,29 @@ class SweepModules(MeasurementSweep):
         ### DEBUG
         # print(f"modules: {modules}, sweep: {sweep}")
 
+        # sweep metadata saved once before sweep into `sweep_save_dir`,
+        # each measured device is appended to its `devices.jsonl`
+        sweep_save_dir = f"sweep_{timestamp()}"
+        sweep_metadata = MeasurementSweep.save_metadata(
+            user=user,
+            sweep_name=SweepModules.name,
+            sweep_config_string=sweep_config_string,
+            initial_die_x=initial_die_x,
+            initial_die_y=initial_die_y,
+            die_dx=die_dx,
+            die_dy=die_dy,
+            initial_device_row=initial_device_row,
+            initial_device_col=initial_device_col,
+            device_dx=device_dx,
+            device_dy=device_dy,
+            data_folder=data_folder,
+            sweep_save_dir=sweep_save_dir,
+            save_data=sweep_save_data,
+            programs=programs,
+        )
+        # serialized once, reused by all monitor updates in this sweep
+        sweep_metadata_json = json_dumps(sweep_metadata)
+
         # create closure here to simplify passing arguments
         def run_inner(
             module_str: str,
@@ -93,22 +120,14 @@ class SweepModules(MeasurementSweep):
             t_measurement = timestamp()
             save_dir = f"gax_{module_str}_{t_measurement}"
 
-            sweep_metadata = MeasurementSweep.save_metadata(
-                user=user,
-                sweep_name=SweepModules.name,
-                sweep_config_string=sweep_config_string,
-                initial_die_x=initial_die_x,
-                initial_die_y=initial_die_y,
-                die_dx=die_dx,
-                die_dy=die_dy,
-                initial_device_row=initial_device_row,
-                initial_device_col=initial_device_col,
-                device_dx=device_dx,
-                device_dy=device_dy,
+            MeasurementSweep.save_device_metadata(
                 data_folder=data_folder,
+                sweep_save_dir=sweep_save_dir,
                 save_dir=save_dir,
                 save_data=sweep_save_data,
                 programs=programs,
+                t_measurement=t_measurement,
+                module=module_str,
             )
 
             for pr in programs:
@@ -118,19 +137,16 @@ class SweepModules(MeasurementSweep):
                     monitor_channel=monitor_channel,
                     signal_cancel=signal_cancel,
                     sweep_metadata=sweep_metadata,
+                    sweep_metadata_json=sweep_metadata_json,
                     data_folder=data_folder,
                     save_dir=save_dir,
                     save_data=sweep_save_data,
                     program=pr,
                 )
 
-                # yields thread for other tasks (so data gets pushed)
-                # TODO: proper multithreaded task
-                gevent.sleep(0.3)
-            
-            # yields thread for other tasks
-            # TODO: proper multithreaded task
-            gevent.sleep(0.3)
+                # yield to other tasks (so data gets pushed), no delay needed since
+                # file writes and monitor publish do not block
+                gevent.sleep(0)
 
         for module_name in sweep:
             module = modules[module_name]
@@ -145,6 +161,6 @@ class SweepModules(MeasurementSweep):
             run_inner(module_name)
 
             # check cancel signal and return if received
-            if signal_cancel is not None and signal_cancel.is_cancelled():
+            if is_cancelled():
                 logging.info("Measurement cancelled by signal.")
                 return
@@ -1,72 +1,127 @@
 import os
 import logging
 import gevent
-from controller.sweeps import MeasurementSweep
-from controller.util import timestamp
+from controller.sse import json_dumps
+from controller.sweeps import MeasurementSweep, array_sweep_plan
+from controller.util import timestamp, SignalCancelTask
+
+# cache of height offset file path => (file mtime, interpolation function),
+# so repeated sweeps with same height offset file skip loading and fitting.
+# One entry per file path (stale entry replaced when file is modified), only
+# a few height offset files are used, so cache is not otherwise bounded.
+_die_height_offset_interp2d_cache = {}
 
 def create_die_height_offset_interp2d(
     path_die_measurements: str,
+):
+    """Return cached die height offset interpolation function for height
+    offset measurements file, see `load_die_height_offset_interp2d`.
+    Cache is invalidated when the file is modified.
+    """
+    path = os.path.abspath(path_die_measurements)
+    mtime = os.path.getmtime(path)
+    cached = _die_height_offset_interp2d_cache.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    interp2d_func = load_die_height_offset_interp2d(path_die_measurements)
+    _die_height_offset_interp2d_cache[path] = (mtime, interp2d_func)
+    return interp2d_func
+
+def load_die_height_offset_interp2d(
+    path_die_measurements: str,
 ):
     """Load die height offset measurements from file and generate heightmap
-    using basic linear interpolation. For interpolation methods, see
+    using piecewise cubic interpolation on a delaunay triangulation of the
+    measured points (`CloughTocher2DInterpolator`). For interpolation
+    methods, see
     https://stackoverflow.com/questions/54432470/how-to-get-a-non-smoothing-2d-spline-interpolation-with-scipy
 
-    Issue with default scipy.interpolate.interp2d is that it relies on
-    fitting coefficients, so the resulting curve is smooth. However, this
-    does not guarantee the interpolated values will end up going through
-    the input points.
+    Unlike scipy.interpolate.interp2d (which fits spline coefficients, so
+    the resulting surface does not necessarily go through input points),
+    this interpolates directly between points, so heights at measured die
+    locations match the input exactly. Points outside the convex hull of the
+    measured points use the nearest measured point's offset. If the points
+    cannot be triangulated (fewer than 3 or colinear), nearest measured
+    point is used everywhere, and an empty file gives zero offsets.
 
     Returns a function `interp2d(x, y): dz` that gives interpolated height
-    offset (dz < 0.0) at a given die location (x, y).
+    offset (dz < 0.0) at die location (x, y). `x`, `y` can be scalars or
+    arrays of points (evaluated pointwise).
     """
-    import tomli
+    from controller.util import toml_compat
     import numpy as np
-    from scipy.interpolate import interp2d
+    from scipy.interpolate import CloughTocher2DInterpolator, NearestNDInterpolator
     
     with open(path_die_measurements, "rb") as f:
-        toml_dict = tomli.load(f)
+        toml_dict = toml_compat.load(f)
         
-        # fill arrays of points and height offsets
-        num_points = len(toml_dict["die_height_offset"])
-        x_vals = np.full((num_points,), np.nan)
-        y_vals = np.full((num_points,), np.nan)
-        dz_vals = np.full((num_points,), np.nan)
-
-        # each measurement is in format like {x: -1.0, y: -2.0, dz: -4}
-        for i, x_y_dz in enumerate(toml_dict["die_height_offset"]):
-            x, y, dz = x_y_dz.values()
-            x_vals[i] = x
-            y_vals[i] = y
-            dz_vals[i] = dz
-
-        # alternative interpolation method, uses delaunay triangulation
-        # and just directly interpolates points. this method ensures heights
-        # go through input points
-        # die_dz_ct_interp2d = CloughTocher2DInterpolator(
-        #     np.concatenate((x_vals[:, None], y_vals[:, None]), axis=1),
-        #     dz_vals,
-        # )
-
-        ### DEBUG
-        # print(x_vals)
-        # print(y_vals)
-        # print(dz_vals)
-
-        # just use scipy.interpolate.interp2d (fits coefficients)
-        # using linear instead of cubic, because cubic function often does not
-        # match exact height values sampled at die locations
-        interp2d_fn = interp2d(x_vals, y_vals, dz_vals, kind="linear")
+        # each measurement is in format like {x: -1.0, y: -2.0, dz: -4},
+        # read by key so order of keys in file does not matter
+        measurements = np.array(
+            [ [p["x"], p["y"], p["dz"]] for p in toml_dict["die_height_offset"] ],
+            dtype=np.float64,
+        ).reshape(-1, 3)
+        x_vals = measurements[:, 0]
+        y_vals = measurements[:, 1]
+        dz_vals = measurements[:, 2]
+
+        points = np.column_stack((x_vals, y_vals))
+
+        if len(points) == 0:
+            logging.warning(f"No die height offsets in {path_die_measurements}, height compensation disabled")
+            def interp_fn(x, y):
+                return np.zeros(np.broadcast(x, y).shape)
+        else:
+            try:
+                ct_interp_fn = CloughTocher2DInterpolator(points, dz_vals, fill_value=np.nan)
+            except Exception as err:
+                # triangulation fails for < 3 points or colinear points,
+                # fall back to nearest measured point everywhere
+                logging.warning(f"Die height offset triangulation failed, using nearest measured point: {err}")
+                ct_interp_fn = None
+            nearest_interp_fn = NearestNDInterpolator(points, dz_vals)
+
+            def interp_fn(x, y):
+                if ct_interp_fn is None:
+                    return nearest_interp_fn(x, y)
+                dz = ct_interp_fn(x, y)
+                # outside convex hull of measured points
+                outside = np.isnan(dz)
+                if np.any(outside):
+                    dz = np.where(outside, nearest_interp_fn(x, y), dz)
+                return dz
+
+        # cache of (x, y) => dz, dies are usually revisited across sweeps
+        dz_cache = {}
 
         def die_dz_interp2d_func(x, y):
-            dz = np.minimum(0.0, interp2d_fn(x, y))
-            if np.isscalar(dz):
+            if np.ndim(x) == 0 and np.ndim(y) == 0:
+                dz = dz_cache.get((x, y))
+                if dz is None:
+                    dz = min(0.0, float(interp_fn(x, y)))
+                    dz_cache[(x, y)] = dz
                 return dz
-            else:
-                return np.squeeze(dz)
+            return np.minimum(0.0, interp_fn(x, y))
 
         return die_dz_interp2d_func
 
 
+def die_height_offsets(
+    die_dz_interp2d,
+    die_coordinates: list,
+) -> dict:
+    """Evaluate height offsets for all die coordinates up front in a single
+    pointwise interpolation call. Returns dict of (die_x, die_y) => dz.
+    """
+    import numpy as np
+    dies = [ (int(x), int(y)) for x, y in die_coordinates ]
+    if len(dies) == 0:
+        return {}
+    xy = np.array(dies, dtype=np.float64)
+    dz = die_dz_interp2d(xy[:, 0], xy[:, 1])
+    return { die: float(v) for die, v in zip(dies, dz) }
+
+
 class SweepMultiDieArray(MeasurementSweep):
     """Implement an array sweep on multiple dies: foreach die
     coordinate, run an array sweep.
@@ -88,11 +143,16 @@ class SweepMultiDieArray(MeasurementSweep):
             ]
 
             # height_compensation_file = "height_offset.toml"
+
+            # delay in seconds for stage to settle after moving to new die
+            die_settle_time = 0.5
             
             [array]
             num_rows = 1
             num_cols = 1
             sweep_order = "row"
+            serpentine = false
+            save_single_file = false
         """
     
     def run(
@@ -116,24 +176,80 @@ class SweepMultiDieArray(MeasurementSweep):
         signal_cancel=None,
     ):
         """Run the sweep."""
+        if signal_cancel is None:
+            signal_cancel = SignalCancelTask.never()
+        # bound once, checked after every device
+        is_cancelled = signal_cancel.is_cancelled
 
         # unpack config
-        die_coordinates = sweep_config["dies"]
+        # make sure die coords are integers (config may contain floats)
+        die_coordinates = [ (int(c[0]), int(c[1])) for c in sweep_config["dies"] ]
+        # mechanical settle delay after stage moves between dies
+        die_settle_time = sweep_config.get("die_settle_time", 0.5)
         num_rows = sweep_config["array"]["num_rows"]
         num_cols = sweep_config["array"]["num_cols"]
         sweep_order = sweep_config["array"]["sweep_order"]
+        serpentine = sweep_config["array"].get("serpentine", False)
+        # save all device results in one `sweep.h5` instead of file per device
+        save_single_file = sweep_config["array"].get("save_single_file", False)
 
-        if "height_compensation_file" in sweep_config:
-            path_height_compensation = sweep_config["height_compensation_file"]
+        # precompute device order and chuck positions (relative to die home),
+        # same for each die
+        rows, cols, xs, ys = array_sweep_plan(
+            num_rows=num_rows,
+            num_cols=num_cols,
+            initial_device_row=initial_device_row,
+            initial_device_col=initial_device_col,
+            device_dx=device_dx,
+            device_dy=device_dy,
+            sweep_order=sweep_order,
+            serpentine=serpentine,
+        )
+        row_col_format = "r{row}_c{col}" if sweep_order == "row" else "c{col}_r{row}"
+
+        # unset, None or empty path disables height compensation
+        path_height_compensation = sweep_config.get("height_compensation_file")
+        if path_height_compensation:
             die_dz_interp2d = create_die_height_offset_interp2d(path_height_compensation)
+            # precompute height offset of all dies, per die lookup in sweep loop
+            die_dz = die_height_offsets(die_dz_interp2d, die_coordinates)
             use_height_compensation = True
         else:
             use_height_compensation = False
         
+        # sweep metadata saved once before sweep into `sweep_save_dir`,
+        # each measured device is appended to its `devices.jsonl`
+        sweep_save_dir = f"sweep_{timestamp()}"
+        sweep_metadata = MeasurementSweep.save_metadata(
+            user=user,
+            sweep_name=SweepMultiDieArray.name,
+            sweep_config_string=sweep_config_string,
+            initial_die_x=initial_die_x,
+            initial_die_y=initial_die_y,
+            die_dx=die_dx,
+            die_dy=die_dy,
+            initial_device_row=initial_device_row,
+            initial_device_col=initial_device_col,
+            device_dx=device_dx,
+            device_dy=device_dy,
+            data_folder=data_folder,
+            sweep_save_dir=sweep_save_dir,
+            save_data=sweep_save_data,
+            programs=programs,
+        )
+        # serialized once, reused by all monitor updates in this sweep
+        sweep_metadata_json = json_dumps(sweep_metadata)
+
+        # bind per device calls as locals, closure reads instead of
+        # class attribute lookups in sweep loop
+        save_device_metadata = MeasurementSweep.save_device_metadata
+        run_single = MeasurementSweep.run_single
+
         # create closure here to simplify passing arguments
         def run_inner(
             die_x: int,
             die_y: int,
+            die_dir: str,
             row: int,
             col: int,
             row_col_str: str,
@@ -144,63 +260,52 @@ class SweepMultiDieArray(MeasurementSweep):
             - sweep_order = "col": Sweep rows in col, then change col. str is "c0_r0", "c0_r1", ...
             """
             t_measurement = timestamp()
-            save_dir = os.path.join(f"die_x_{die_x}_y_{die_y}", f"gax_{row_col_str}_{t_measurement}")
-
-            sweep_metadata = MeasurementSweep.save_metadata(
-                user=user,
-                sweep_name=SweepMultiDieArray.name,
-                sweep_config_string=sweep_config_string,
-                initial_die_x=initial_die_x,
-                initial_die_y=initial_die_y,
-                die_dx=die_dx,
-                die_dy=die_dy,
-                initial_device_row=initial_device_row,
-                initial_device_col=initial_device_col,
-                device_dx=device_dx,
-                device_dy=device_dy,
+            save_dir = f"{die_dir}/gax_{row_col_str}_{t_measurement}"
+
+            save_device_metadata(
                 data_folder=data_folder,
+                sweep_save_dir=sweep_save_dir,
                 save_dir=save_dir,
                 save_data=sweep_save_data,
                 programs=programs,
+                t_measurement=t_measurement,
+                save_single_file=save_single_file,
+                die_x=die_x, die_y=die_y, row=row, col=col, row_col_str=row_col_str,
             )
 
             for pr in programs:
                 logging.info(f"[row={row}, col={col}] Running {pr.name}...")
-                MeasurementSweep.run_single(
+                run_single(
                     instr_b1500=instr_b1500,
                     monitor_channel=monitor_channel,
                     signal_cancel=signal_cancel,
                     sweep_metadata=sweep_metadata,
+                    sweep_metadata_json=sweep_metadata_json,
                     data_folder=data_folder,
                     save_dir=save_dir,
                     save_data=sweep_save_data,
                     program=pr,
+                    sweep_save_dir=sweep_save_dir,
+                    save_single_file=save_single_file,
                 )
 
-                # yields thread for other tasks (so data gets pushed)
-                # TODO: proper multithreaded task
-                gevent.sleep(0.3)
-            
-            # yields thread for other tasks
-            # TODO: proper multithreaded task
-            gevent.sleep(0.3)
+                # yield to other tasks (so data gets pushed), no delay needed since
+                # file writes and monitor publish do not block
+                gevent.sleep(0)
 
         # store current die location
         current_die_x = initial_die_x
         current_die_y = initial_die_y
 
-        for die_coord in die_coordinates:
-            die_x, die_y = die_coord
-            
-            # make sure die coords are integers
-            die_x = int(die_x)
-            die_y = int(die_y)
-
+        for die_x, die_y in die_coordinates:
             logging.info(f"Moving to die ({die_x}, {die_y})")
 
+            # die save directory, shared by all devices in die
+            die_dir = f"die_x_{die_x}_y_{die_y}"
+
             # get height for contact
             if use_height_compensation:
-                dz = die_dz_interp2d(die_x, die_y)
+                dz = die_dz[(die_x, die_y)]
             else:
                 dz = 0
             
@@ -209,7 +314,7 @@ class SweepMultiDieArray(MeasurementSweep):
                 if current_die_x != die_x or current_die_y != die_y:
                     # move to contact height (stop contacting devices)
                     instr_cascade.move_contacts_up()
-                    gevent.sleep(0.5) # ensure small delay
+                    gevent.sleep(die_settle_time) # let stage settle
 
                     # move chuck to target die location using relative coord from current die
                     dx_to_die = (die_x - current_die_x) * die_dx
@@ -225,48 +330,21 @@ class SweepMultiDieArray(MeasurementSweep):
                     current_die_x = die_x
                     current_die_y = die_y
 
-                    gevent.sleep(0.5) # ensure small delay
+                    gevent.sleep(die_settle_time) # let stage settle
 
                     # move contacts back down to contact device
                     instr_cascade.move_to_contact_height_with_offset(dz)
             
-            if sweep_order == "row":
-                for ny, row in enumerate(range(initial_device_row, initial_device_row + num_rows)):
-                    for nx, col in enumerate(range(initial_device_col, initial_device_col + num_cols)):
-                        run_inner(die_x, die_y, row, col, row_col_str=f"r{row}_c{col}")
-                        # check cancel signal and return if received
-                        if signal_cancel is not None and signal_cancel.is_cancelled():
-                            logging.info("Measurement cancelled by signal.")
-                            return
-                        # move chuck by 1 col
-                        if nx < (num_cols-1) and instr_cascade is not None:
-                            instr_cascade.move_contacts_up()
-                            instr_cascade.move_chuck_relative_to_home(x=(nx+1)*device_dx, y=ny*device_dy)
-                            instr_cascade.move_to_contact_height_with_offset(dz)
-                    # move chuck back to col 0, move up by 1 row
-                    if ny < (num_rows-1) and instr_cascade is not None:
-                        instr_cascade.move_contacts_up()
-                        instr_cascade.move_chuck_relative_to_home(x=0, y=(ny+1)*device_dy)
-                        instr_cascade.move_to_contact_height_with_offset(dz)
-            elif sweep_order == "col":
-                for nx, col in enumerate(range(initial_device_col, initial_device_col + num_cols)):
-                    for ny, row in enumerate(range(initial_device_row, initial_device_row + num_rows)):
-                        run_inner(die_x, die_y, row, col, row_col_str=f"c{col}_r{row}")
-                        # check cancel signal and return if received
-                        if signal_cancel is not None and signal_cancel.is_cancelled():
-                            logging.info("Measurement cancelled by signal.")
-                            return
-                        # move chuck by 1 row
-                        if ny < (num_rows-1) and instr_cascade is not None:
-                            instr_cascade.move_contacts_up()
-                            instr_cascade.move_chuck_relative_to_home(x=nx*device_dx, y=(ny+1)*device_dy)
-                            instr_cascade.move_to_contact_height_with_offset(dz)
-                    # move chuck back to row 0, move by 1 col
-                    if nx < (num_cols-1) and instr_cascade is not None:
-                        instr_cascade.move_contacts_up()
-                        instr_cascade.move_chuck_relative_to_home(x=(nx+1)*device_dx, y=0)
-                        instr_cascade.move_to_contact_height_with_offset(dz)
-            else:
-                raise ValueError(f"Invalid sweep_order {sweep_order}, must be 'row' or 'col'")
-        
-        
+            for k in range(len(rows)):
+                row = rows[k]
+                col = cols[k]
+                # move chuck to device (first device is at die home)
+                if k > 0 and instr_cascade is not None:
+                    instr_cascade.move_contacts_up()
+                    instr_cascade.move_chuck_relative_to_home(x=xs[k], y=ys[k])
+                    instr_cascade.move_to_contact_height_with_offset(dz)
+                run_inner(die_x, die_y, die_dir, row, col, row_col_str=row_col_format.format(row=row, col=col))
+                # check cancel signal and return if received
+                if is_cancelled():
+                    logging.info("Measurement cancelled by signal.")
+                    return
@@ -1,10 +1,10 @@
-import os
 import logging
 import gevent
+from controller.sse import json_dumps
 from controller.sweeps import MeasurementSweep
-from controller.util import timestamp
+from controller.util import timestamp, SignalCancelTask
 from controller.sweeps.modules import load_modules_from_toml, load_sweep_from_toml
-from controller.sweeps.multi_die_array import create_die_height_offset_interp2d
+from controller.sweeps.multi_die_array import create_die_height_offset_interp2d, die_height_offsets
 
 class SweepMultiDieModules(MeasurementSweep):
     """Implement an array sweep on multiple dies: foreach die
@@ -30,6 +30,9 @@ class SweepMultiDieModules(MeasurementSweep):
             ### uncomment to enable per-die height compensation
             ### adjusts probe height based on interpolated measured wafer heightmap
             # height_compensation_file = "height_offset.toml"
+
+            ### delay in seconds for stage to settle after moving to new die
+            die_settle_time = 0.5
             
             ### uncomment to use modules file .toml
             # modules_file = "modules.toml"
@@ -67,13 +70,23 @@ class SweepMultiDieModules(MeasurementSweep):
         signal_cancel=None,
     ):
         """Run the sweep."""
+        if signal_cancel is None:
+            signal_cancel = SignalCancelTask.never()
+        # bound once, checked after every device
+        is_cancelled = signal_cancel.is_cancelled
 
         # unpack config
-        die_coordinates = sweep_config["dies"]
-
-        if "height_compensation_file" in sweep_config:
-            path_height_compensation = sweep_config["height_compensation_file"]
+        # make sure die coords are integers (config may contain floats)
+        die_coordinates = [ (int(c[0]), int(c[1])) for c in sweep_config["dies"] ]
+        # mechanical settle delay after stage moves between dies
+        die_settle_time = sweep_config.get("die_settle_time", 0.5)
+
+        # unset, None or empty path disables height compensation
+        path_height_compensation = sweep_config.get("height_compensation_file")
+        if path_height_compensation:
             die_dz_interp2d = create_die_height_offset_interp2d(path_height_compensation)
+            # precompute height offset of all dies, per die lookup in sweep loop
+            die_dz = die_height_offsets(die_dz_interp2d, die_coordinates)
             use_height_compensation = True
         else:
             use_height_compensation = False
@@ -88,76 +101,92 @@ class SweepMultiDieModules(MeasurementSweep):
         else:
             sweep = sweep_config["sweep"]["modules"]
         
+        # sweep metadata saved once before sweep into `sweep_save_dir`,
+        # each measured device is appended to its `devices.jsonl`
+        sweep_save_dir = f"sweep_{timestamp()}"
+        sweep_metadata = MeasurementSweep.save_metadata(
+            user=user,
+            sweep_name=SweepMultiDieModules.name,
+            sweep_config_string=sweep_config_string,
+            initial_die_x=initial_die_x,
+            initial_die_y=initial_die_y,
+            die_dx=die_dx,
+            die_dy=die_dy,
+            initial_device_row=initial_device_row,
+            initial_device_col=initial_device_col,
+            device_dx=device_dx,
+            device_dy=device_dy,
+            data_folder=data_folder,
+            sweep_save_dir=sweep_save_dir,
+            save_data=sweep_save_data,
+            programs=programs,
+        )
+        # serialized once, reused by all monitor updates in this sweep
+        sweep_metadata_json = json_dumps(sweep_metadata)
+
+        # bind per device calls as locals, closure reads instead of
+        # class attribute lookups in sweep loop
+        save_device_metadata = MeasurementSweep.save_device_metadata
+        run_single = MeasurementSweep.run_single
+
         # create closure here to simplify passing arguments
         def run_inner(
             die_x: int,
             die_y: int,
+            die_dir: str,
             module_str: str,
         ):
             """Run measurement at a die coordinate (die_x, die_y) for a named module device.
             Inputs:
             - `die_x`: die x coordinate.
             - `die_y`: die y coordinate.
+            - `die_dir`: die save directory, shared by all modules in die.
             - `module_str`: module name (mainly as metadata).
             """
             t_measurement = timestamp()
-            save_dir = os.path.join(f"die_x_{die_x}_y_{die_y}", f"gax_{module_str}_{t_measurement}")
-
-            sweep_metadata = MeasurementSweep.save_metadata(
-                user=user,
-                sweep_name=SweepMultiDieModules.name,
-                sweep_config_string=sweep_config_string,
-                initial_die_x=initial_die_x,
-                initial_die_y=initial_die_y,
-                die_dx=die_dx,
-                die_dy=die_dy,
-                initial_device_row=initial_device_row,
-                initial_device_col=initial_device_col,
-                device_dx=device_dx,
-                device_dy=device_dy,
+            save_dir = f"{die_dir}/gax_{module_str}_{t_measurement}"
+
+            save_device_metadata(
                 data_folder=data_folder,
+                sweep_save_dir=sweep_save_dir,
                 save_dir=save_dir,
                 save_data=sweep_save_data,
                 programs=programs,
+                t_measurement=t_measurement,
+                die_x=die_x, die_y=die_y, module=module_str,
             )
 
             for pr in programs:
                 logging.info(f"[die=({die_x},{die_y}), module={module_str}] Running {pr.name}...")
-                MeasurementSweep.run_single(
+                run_single(
                     instr_b1500=instr_b1500,
                     monitor_channel=monitor_channel,
                     signal_cancel=signal_cancel,
                     sweep_metadata=sweep_metadata,
+                    sweep_metadata_json=sweep_metadata_json,
                     data_folder=data_folder,
                     save_dir=save_dir,
                     save_data=sweep_save_data,
                     program=pr,
                 )
 
-                # yields thread for other tasks (so data gets pushed)
-                # TODO: proper multithreaded task
-                gevent.sleep(0.3)
-            
-            # yields thread for other tasks
-            # TODO: proper multithreaded task
-            gevent.sleep(0.3)
+                # yield to other tasks (so data gets pushed), no delay needed since
+                # file writes and monitor publish do not block
+                gevent.sleep(0)
 
         # store current die location
         current_die_x = initial_die_x
         current_die_y = initial_die_y
 
-        for die_coord in die_coordinates:
-            die_x, die_y = die_coord
-            
-            # make sure die coords are integers
-            die_x = int(die_x)
-            die_y = int(die_y)
-
+        for die_x, die_y in die_coordinates:
             logging.info(f"Moving to die ({die_x}, {die_y})")
 
+            # die save directory, shared by all modules in die
+            die_dir = f"die_x_{die_x}_y_{die_y}"
+
             # get height for contact
             if use_height_compensation:
-                dz = die_dz_interp2d(die_x, die_y)
+                dz = die_dz[(die_x, die_y)]
             else:
                 dz = 0
             
@@ -166,7 +195,7 @@ class SweepMultiDieModules(MeasurementSweep):
                 if current_die_x != die_x or current_die_y != die_y:
                     # move to contact height (stop contacting devices)
                     instr_cascade.move_contacts_up()
-                    gevent.sleep(0.5) # ensure small delay
+                    gevent.sleep(die_settle_time) # let stage settle
 
                     # move chuck to target die location using relative coord from current die
                     dx_to_die = (die_x - current_die_x) * die_dx
@@ -198,11 +227,12 @@ class SweepMultiDieModules(MeasurementSweep):
                 run_inner(
                     die_x=die_x,
                     die_y=die_y,
+                    die_dir=die_dir,
                     module_str=module_name,
                 )
 
                 # check cancel signal and return if received
-                if signal_cancel is not None and signal_cancel.is_cancelled():
+                if is_cancelled():
                     logging.info("Measurement cancelled by signal.")
                     return
 
@@ -1,4 +1,5 @@
 import gevent
+from controller.sse import json_dumps
 from controller.sweeps import MeasurementSweep
 from controller.util import timestamp
 
@@ -17,6 +18,7 @@ class SweepSingle(MeasurementSweep):
         """Return default `sweep_config` argument in `run` as a dict."""
         return """
             programs = []
+            save_single_file = false
         """
     
     def run(
@@ -40,8 +42,12 @@ class SweepSingle(MeasurementSweep):
         signal_cancel=None,
     ):
         """Run the sweep. Just a wrapper around MeasurementSweep.run_single."""
+        # save all program results in one `sweep.h5` instead of file per program
+        save_single_file = sweep_config.get("save_single_file", False)
+
         t_measurement = timestamp()
         save_dir = f"gax_r{initial_device_row}_c{initial_device_col}_{t_measurement}"
+        sweep_save_dir = f"sweep_{t_measurement}"
 
         sweep_metadata = MeasurementSweep.save_metadata(
             user=user,
@@ -56,9 +62,22 @@ class SweepSingle(MeasurementSweep):
             device_dx=device_dx,
             device_dy=device_dy,
             data_folder=data_folder,
+            sweep_save_dir=sweep_save_dir,
+            save_data=sweep_save_data,
+            programs=programs,
+        )
+        # serialized once, reused by all monitor updates in this sweep
+        sweep_metadata_json = json_dumps(sweep_metadata)
+        MeasurementSweep.save_device_metadata(
+            data_folder=data_folder,
+            sweep_save_dir=sweep_save_dir,
             save_dir=save_dir,
             save_data=sweep_save_data,
             programs=programs,
+            t_measurement=t_measurement,
+            save_single_file=save_single_file,
+            row=initial_device_row,
+            col=initial_device_col,
         )
 
         for pr in programs:
@@ -67,12 +86,15 @@ class SweepSingle(MeasurementSweep):
                 monitor_channel=monitor_channel,
                 signal_cancel=signal_cancel,
                 sweep_metadata=sweep_metadata,
+                sweep_metadata_json=sweep_metadata_json,
                 data_folder=data_folder,
                 save_dir=save_dir,
                 save_data=sweep_save_data,
                 program=pr,
+                sweep_save_dir=sweep_save_dir,
+                save_single_file=save_single_file,
             )
 
-            # yields thread for other tasks (so data gets pushed)
-            # TODO: proper multithreaded task
-            gevent.sleep(0.3)
\ No newline at end of file
+            # yield to other tasks (so data gets pushed), no delay needed since
+            # file writes and monitor publish do not block
+            gevent.sleep(0)
\ No newline at end of file
@@ -3,17 +3,196 @@ Data import/export utilities.
 """
 
 import os
+import json
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
 import h5py
 from scipy.io import savemat, loadmat
 import numpy as np
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-def export_hdf5(path: str, data: dict):
+try:
+    import hdf5plugin # registers lz4 filter with h5py
+except ImportError:
+    hdf5plugin = None
+
+# compress large hdf5 datasets with lz4 (requires `hdf5plugin`) instead of
+# built-in gzip. opt-in: lz4 files cannot be read by matlab, stock hdf5
+# tools or h5py without hdf5plugin installed
+HDF5_USE_LZ4 = False
+
+try:
+    import hdf5storage # matlab v7.3 (hdf5 based) .mat writer
+except ImportError:
+    hdf5storage = None
+
+# numeric arrays at least this size in bytes are written chunked and
+# compressed in hdf5, smaller arrays are contiguous (filter overhead is
+# not worth it for small datasets)
+HDF5_COMPRESS_MIN_BYTES = 65536
+
+# target chunk size in bytes for stacked (merged) arrays chunked by rows
+HDF5_ROW_CHUNK_BYTES = 2**20
+
+# hdf5 files with total data below this size in bytes are built in memory
+# and written to disk with a single write, larger files are written directly
+# (avoids holding a second in-memory copy of large data)
+HDF5_FILE_IMAGE_MAX_BYTES = 64 * 2**20
+
+# number of threads prefetching input files in `merge_hdf5`
+HDF5_MERGE_READ_THREADS = 8
+
+# matlab v5 .mat files (scipy savemat) cannot store arrays of 2 GB or more,
+# larger arrays are written in hdf5 based v7.3 format instead
+MAT_V5_MAX_BYTES = 2**31 - 1
+
+# background thread pool for writing data files, so slow disk writes do not
+# block the measurement greenlet (and SSE updates). created on first use.
+_write_pool = None
+
+# (write function name, path, exception) of failed background writes since
+# last `wait_writes`, appended from write threads (list.append is atomic)
+_write_errors = []
+
+def _write_task(f, *args):
+    """Run a file write task in write thread. Errors are logged and
+    recorded (otherwise they are silently dropped by the thread pool),
+    then raised by the next `wait_writes`."""
+    try:
+        f(*args)
+    except Exception as err:
+        path = args[0] if len(args) > 0 else None
+        logging.error(f"Failed writing data in background write task {f.__name__}({path}): {err}")
+        _write_errors.append((f.__name__, path, err))
+
+def write_async(f, *args):
+    """Run file write `f(*args)` in a background write thread. Data passed
+    must not be modified afterwards by the caller. Pool has 2 write threads,
+    if both are busy this blocks the calling greenlet until one is free
+    (natural backpressure when measurements outpace disk writes).
+    """
+    global _write_pool
+    if _write_pool is None:
+        from gevent.threadpool import ThreadPool
+        _write_pool = ThreadPool(maxsize=2)
+    _write_pool.spawn(_write_task, f, *args)
+
+def wait_writes():
+    """Block until all background file writes are finished. If any write
+    failed since the last call, raises `RuntimeError` (chained from the
+    first error) listing the failed files."""
+    if _write_pool is not None:
+        _write_pool.join()
+    if len(_write_errors) > 0:
+        errors = _write_errors.copy()
+        _write_errors.clear()
+        failed = ", ".join(f"{name}({path})" for name, path, _ in errors)
+        raise RuntimeError(f"{len(errors)} background file writes failed: {failed}") from errors[0][2]
+
+
+def export_json(path: str, data: dict):
+    """Export dict to indented json file with a single write. Uses `orjson`
+    if available, otherwise standard `json`."""
+    if orjson is not None:
+        s = orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    else:
+        s = json.dumps(data, indent=2).encode("utf-8")
+    with open(path, "wb") as f:
+        f.write(s)
+
+def append_jsonl(path: str, data: dict):
+    """Append dict as a single compact json line to a json lines file."""
+    if orjson is not None:
+        s = orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_APPEND_NEWLINE)
+    else:
+        s = (json.dumps(data) + "\n").encode("utf-8")
+    with open(path, "ab") as f:
+        f.write(s)
+
+def hdf5_dataset_options(val, row_chunks: bool = False) -> dict:
+    """Return hdf5 `create_dataset` keyword options for a value. Large
+    numeric arrays use auto-sized chunks with byte shuffle + fast gzip
+    level 1 (readable everywhere), or lz4 if `HDF5_USE_LZ4` is set and
+    `hdf5plugin` is installed.
+    If `row_chunks`, multi-dimensional arrays are instead chunked by whole
+    rows along first axis (e.g. whole devices in merged device arrays),
+    so reading a row decompresses only its chunk.
+    """
+    if isinstance(val, np.ndarray) and val.dtype.kind in "biuf" and val.nbytes >= HDF5_COMPRESS_MIN_BYTES:
+        if row_chunks and val.ndim > 1:
+            row_nbytes = val.nbytes // val.shape[0]
+            chunks = (max(1, min(val.shape[0], HDF5_ROW_CHUNK_BYTES // row_nbytes)), *val.shape[1:])
+        else:
+            chunks = True
+        if HDF5_USE_LZ4 and hdf5plugin is not None:
+            return {"chunks": chunks, "shuffle": True, **hdf5plugin.LZ4()}
+        else:
+            return {"chunks": chunks, "shuffle": True, "compression": "gzip", "compression_opts": 1}
+    return {}
+
+def hdf5_value(val):
+    """Convert string arrays to fixed-length utf-8 byte string arrays for
+    hdf5. Object dtype arrays of str would be stored as variable-length
+    strings (heap pointer per element), numpy unicode arrays have no hdf5
+    equivalent. Other values are returned unchanged.
+    """
+    if isinstance(val, np.ndarray):
+        if val.dtype.kind == "U":
+            return np.char.encode(val, "utf-8")
+        if val.dtype.kind == "O" and all(isinstance(x, str) for x in val.flat):
+            return np.char.encode(val.astype(str), "utf-8")
+    return val
+
+def export_hdf5(path: str, data: dict, row_chunks: bool = False):
     """Export all keys in dict to hdf5 datasets, and save hdf5 file.
+    Each result file is written once by a single writer, so hdf5 file
+    locking is disabled (skips lock syscalls on open/close).
+    Files under `HDF5_FILE_IMAGE_MAX_BYTES` are built in memory (hdf5 core
+    driver) and written with one write instead of many small hdf5 writes.
+    `row_chunks` chunks large arrays by rows, see `hdf5_dataset_options`.
     """
-    with h5py.File(path, "w") as h5:
+    nbytes = sum(val.nbytes for val in data.values() if isinstance(val, np.ndarray))
+    if nbytes >= HDF5_FILE_IMAGE_MAX_BYTES:
+        with h5py.File(path, "w", locking=False) as h5:
+            for k, val in data.items():
+                val = hdf5_value(val)
+                h5.create_dataset(k, data=val, **hdf5_dataset_options(val, row_chunks))
+        return
+    
+    with h5py.File(path, "w", driver="core", backing_store=False) as h5:
         for k, val in data.items():
-            h5.create_dataset(k, data=val)
+            val = hdf5_value(val)
+            h5.create_dataset(k, data=val, **hdf5_dataset_options(val, row_chunks))
+        h5.flush()
+        image = h5.id.get_file_image()
+    with open(path, "wb") as f:
+        f.write(image)
+
+# shared sweep hdf5 files are appended to from background write threads,
+# hdf5 file cannot be opened for writing twice at the same time
+_hdf5_group_lock = threading.Lock()
+
+def export_hdf5_group(path: str, group: str, data: dict):
+    """Export all keys in dict to hdf5 datasets in `group` of a shared hdf5
+    file (e.g. a sweep's `sweep.h5`), creating the file and group if needed.
+    Existing datasets with the same keys in the group are replaced.
+    Writers are serialized by `_hdf5_group_lock`, so hdf5 file locking
+    is disabled.
+    """
+    with _hdf5_group_lock, h5py.File(path, "a", locking=False) as h5:
+        g = h5.require_group(group)
+        for k, val in data.items():
+            if k in g:
+                del g[k]
+            val = hdf5_value(val)
+            g.create_dataset(k, data=val, **hdf5_dataset_options(val))
 
 def import_hdf5(path):
     """Import device id-vg datasets in an hdf5 file
@@ -26,14 +205,73 @@ def import_hdf5(path):
             if len(h5[k].shape) > 0:
                 d[k] = h5[k][:]
             else:
-                d[k] = np.asscalar(h5[k][()])
+                v = h5[k][()]
+                d[k] = v.item() if isinstance(v, np.generic) else v
 
     return d
 
+def _read_file_bytes(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+def merge_hdf5(paths: list) -> dict:
+    """Merge hdf5 files with the same datasets (e.g. same measurement
+    program run on multiple devices) into a dict. Multi-dimensional arrays
+    are stacked along a new first axis in order of `paths` (keeping their
+    dtype), all other values (common properties, e.g. sweep values) are
+    taken from first file. Every file must contain the stacked datasets
+    with the same shape as in first file (raises ValueError otherwise).
+    Files are read ahead in `HDF5_MERGE_READ_THREADS` background threads
+    (overlaps file open/read latency, e.g. on network drives), hdf5 parsing
+    stays in calling thread since h5py serializes all hdf5 calls.
+    """
+    num_files = len(paths)
+
+    # load first file to find data shapes
+    data0 = import_hdf5(paths[0])
+    data_merged = {}
+    stacked_keys = []
+    for k, v in data0.items():
+        if isinstance(v, np.ndarray) and v.ndim > 1:
+            # alloc new array for all files, fill first row. every row is
+            # written below, so no need to initialize
+            data_merged[k] = np.empty((num_files, *v.shape), dtype=v.dtype)
+            data_merged[k][0] = v
+            stacked_keys.append(k)
+        else: # common properties
+            data_merged[k] = v
+    
+    # read multi-dimensional datasets directly into their row of merged
+    # arrays (no intermediate per file arrays). at most 2x threads files
+    # are read ahead, bounds memory held by prefetched files
+    with ThreadPoolExecutor(max_workers=HDF5_MERGE_READ_THREADS) as executor:
+        prefetched = deque()
+        i_next = 1
+        for i in range(1, num_files):
+            while i_next < num_files and len(prefetched) < 2 * HDF5_MERGE_READ_THREADS:
+                prefetched.append(executor.submit(_read_file_bytes, paths[i_next]))
+                i_next += 1
+            with h5py.File(BytesIO(prefetched.popleft().result()), "r") as h5:
+                for k in stacked_keys:
+                    dset = h5.get(k)
+                    if not isinstance(dset, h5py.Dataset) or dset.shape != data_merged[k].shape[1:]:
+                        shape = dset.shape if isinstance(dset, h5py.Dataset) else None
+                        raise ValueError(f"Cannot merge {paths[i]}: dataset {k} has shape {shape}, expected {data_merged[k].shape[1:]} (from {paths[0]})")
+                    dset.read_direct(data_merged[k], dest_sel=np.s_[i])
+    
+    return data_merged
+
 
 def export_mat(path: str, data: dict):
-    """Wrapper around scipy saving matlab .mat file"""
-    savemat(path, data, appendmat=False)
+    """Wrapper around scipy saving matlab .mat file. If any array is too
+    large for v5 format, saves as v7.3 format instead (requires `hdf5storage`).
+    """
+    if any(isinstance(v, np.ndarray) and v.nbytes > MAT_V5_MAX_BYTES for v in data.values()):
+        if hdf5storage is None:
+            raise ValueError(f"Data too large for v5 .mat file {path}, install `hdf5storage` for v7.3 .mat export (or use .h5 result)")
+        hdf5storage.savemat(path, data, appendmat=False, format="7.3", store_python_metadata=False, matlab_compatible=True)
+    else:
+        savemat(path, data, appendmat=False)
 
 def import_mat(path):
     """Wrapper around scipy loadmat"""
@@ -0,0 +1,29 @@
+"""
+TOML parsing compatibility shim. Prefers fastest available parser:
+`rtoml` (rust), then stdlib `tomllib` (python 3.11+), then `tomli`.
+"""
+
+try:
+    import rtoml
+
+    def loads(s: str) -> dict:
+        """Parse toml string into dict."""
+        return rtoml.loads(s)
+
+    def load(f) -> dict:
+        """Parse toml from file opened in binary mode ("rb") into dict."""
+        return rtoml.loads(f.read().decode("utf-8"))
+
+except ImportError:
+    try:
+        import tomllib as _toml
+    except ImportError:
+        import tomli as _toml
+
+    def loads(s: str) -> dict:
+        """Parse toml string into dict."""
+        return _toml.loads(s)
+
+    def load(f) -> dict:
+        """Parse toml from file opened in binary mode ("rb") into dict."""
+        return _toml.load(f)
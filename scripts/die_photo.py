@@ -4,8 +4,8 @@ Support both taking single images or doing an array of images and
 auto-stitching to create a die photo. 
 """
 
-import pyvisa
 import os
+import re
 import time
 import shutil
 import tomli
@@ -42,11 +42,17 @@ name = "eVue3"
 um_per_pixel = 0.22321429 # 100 um / 448 px
 """
 
+# raw die photo tile image file name, "{nx}_{ny}_raw.png"
+RAW_TILE_NAME_RE = re.compile(r"(\d+)_(\d+)_raw\.png")
+
 def timestamp(format="%Y_%m_%d_%H_%M_%S"):
     """Return detailed timestamp string"""
     import datetime
     return datetime.datetime.now(datetime.timezone.utc).strftime(format)
 
+# shared pyvisa resource manager, see `SimpleCascadeController.resource_manager`
+_gpib_resource_manager = None
+
 class SimpleCascadeController:
     """Stripped down version of cascade controller in `controller.backend.controller.py`.
     Contain minimal functions needed to move stage and take images.
@@ -64,11 +70,29 @@ class SimpleCascadeController:
                 top-left is origin, bottom-right is positive x,y (default on MIT
                 novels group cascades)
         """
-        gpib_resource_manager = pyvisa.ResourceManager()
-        self.gpib = gpib_resource_manager.open_resource(addr)
+        self.gpib = SimpleCascadeController.resource_manager().open_resource(addr)
         print(self.gpib.query("*IDN?"))
         self.invert_direction = invert_direction
 
+    @staticmethod
+    def resource_manager():
+        """Return shared pyvisa resource manager, created on first use.
+        Resource manager startup (visa backend loading) is slow, so it is
+        reused by all controller connections.
+        """
+        global _gpib_resource_manager
+        if _gpib_resource_manager is None:
+            # imported here so stitch-only runs skip visa backend loading
+            import pyvisa
+            _gpib_resource_manager = pyvisa.ResourceManager()
+        return _gpib_resource_manager
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
     def close(self):
         """Close gpib connection to cascade instrument."""
         self.gpib.close()
@@ -170,28 +194,56 @@ class SimpleCascadeController:
 def move_image_from_remote_when_ready(
     path_remote: str,
     path_out: str,
-    poll_timeout = 0.5, # timeout between poll checks
+    poll_timeout = 0.1, # timeout between poll checks
+    timeout = 30.0,     # max allowed before error 30s
+):
+    """Wait for single image on remote file system and move it to output
+    path, see `move_images_from_remote_when_ready`.
+    """
+    move_images_from_remote_when_ready([(path_remote, path_out)], poll_timeout=poll_timeout, timeout=timeout)
+
+
+def move_images_from_remote_when_ready(
+    paths: list,        # list of (path_remote, path_out)
+    poll_timeout = 0.1, # timeout between poll checks
     timeout = 30.0,     # max allowed before error 30s
 ):
     """Issue is there is no way to query when image is ready after
     sending the GPIB command. So instead rely on polling to check
-    if image is done. When done, move it from remote file system to
+    if images are done. When done, move each from remote file system to
     desired output path.
 
-    From testing, it can take 8-10s for image to be ready and appear, so
-    polling is done by default at coarse 0.5s intervals.
+    From testing, it can take 8-10s for image to be ready and appear.
+    Each poll lists each remote directory once (one network request for
+    both labeled and raw images, instead of a stat per image), so poll
+    at 0.1s intervals to pick up images soon after they appear.
     """
     tstart = time.perf_counter()
 
+    # remote directory => {image name: (path_remote, path_out)}
+    waiting = {}
+    for path_remote, path_out in paths:
+        path_dir, name = os.path.split(path_remote)
+        waiting.setdefault(path_dir, {})[name] = (path_remote, path_out)
+
     while True:
         # print(f"POLLING ({time.perf_counter() - tstart})")
-        if os.path.exists(path_remote):
-            shutil.move(path_remote, path_out)
+        for path_dir, images in list(waiting.items()):
+            with os.scandir(path_dir) as entries:
+                names_present = [ e.name for e in entries if e.name in images ]
+            for name in names_present:
+                path_remote, path_out = images.pop(name)
+                shutil.move(path_remote, path_out)
+            if len(images) == 0:
+                del waiting[path_dir]
+        
+        if len(waiting) == 0:
             return
         else:
             dt = time.perf_counter() - tstart
             if dt > timeout:
-                raise RuntimeError(f"Failed to get output image in time {path_remote} (timeout: {timeout})")
+                missing = [ p for images in waiting.values() for p, _ in images.values() ]
+                raise RuntimeError(f"Failed to get output images in time {missing} (timeout: {timeout})")
             time.sleep(poll_timeout)
 
 
@@ -205,6 +257,8 @@ def stitch_images(
     contrast: float = 0.75,  # contrast filtering, helps reduces lighting discontinuity at edge
     format: str = "png",
     show_image: bool = True, # display output image in system image viewer after stitching
+    jobs: int = None,        # number of threads for processing tiles, None -> executor default
+    feather: int = 0,        # blend width in output px extended into margin on each tile edge, 0 -> hard crop
 ):
     """Routine to stitch together a folder of raw images into a single die 
     photo panorama. Each image is as follows:
@@ -223,36 +277,47 @@ def stitch_images(
     1. Calculate merged image size after including downsampling.
     2. Create output merged image buffer.
     3. Foreach image:
-        3.1. Downsample (before cropping to reduce aliasing at edges)
-        3.2. Crop center region
-        3.3. Insert into correct coordinates in output img buffer.
+        3.1. Downsample center region only (single resize with source crop
+             box, same result as downsampling full image then cropping)
+        3.2. Insert into correct coordinates in output img buffer.
+    
+    If `feather` > 0, each tile also keeps `feather` px of its margin on
+    each edge, so neighbouring tiles overlap by 2*feather px. Tiles are
+    cross-faded over the overlap with raised cosine weights (accumulate
+    weighted tiles, then normalize by sum of weights) instead of butting
+    hard cropped edges, which hides residual lighting seams.
     
     Downsampling then stitching will introduce 
     If input count_x or count_y are None, this must search raw image folder
     to find number of images along each axis.
     """
     from math import floor, ceil
-    from PIL import Image, ImageEnhance
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    import numpy as np
+    from PIL import Image
 
     # generate a folder for this run
     path_raw_images = os.path.join(path_out, "raw")
     if not os.path.exists(path_raw_images):
         raise ValueError(f"No raw images to stitch in path {path_raw_images}")
 
-    # if count not specified, search through images to find images taken 
+    # find raw tile images "{nx}_{ny}_raw.png" in one directory scan,
+    # map of (nx, ny) => path
+    path_tiles = {}
+    with os.scandir(path_raw_images) as entries:
+        for entry in entries:
+            m = RAW_TILE_NAME_RE.fullmatch(entry.name)
+            if m is not None:
+                path_tiles[(int(m.group(1)), int(m.group(2)))] = entry.path
+
+    # if count not specified, use images found to get images taken 
     # on each axis
     if count_x is None or count_y is None:
         print(f"count_x or count_y not specified...searching for images in {path_raw_images}...")
-        count_x = 0
-        count_y = 0
-        for p in os.listdir(path_raw_images):
-            if p.endswith("_raw.png"):
-                s_chunks = p.split("_")
-                count_x = max(count_x, int(s_chunks[0]))
-                count_y = max(count_y, int(s_chunks[1]))
         # add 1 to get actual array size
-        count_x += 1
-        count_y += 1
+        count_x = 1 + max((nx for nx, _ in path_tiles), default=0)
+        count_y = 1 + max((ny for _, ny in path_tiles), default=0)
         print(f"Found count = ({count_x}, {count_y})")
 
     # calculate um actually used per image. insert margin in images,
@@ -284,25 +349,97 @@ def stitch_images(
 
     # print(croparea)
 
-    # stitch images together starting from top-left
-    img = Image.new(mode="RGB", size=(count_x * downsampled_img_chunk_size_x_px, count_y * downsampled_img_chunk_size_y_px))
-    # print(img)
-
-    for nx in range(count_x):
-        for ny in range(count_y):
-            path_img_chunk = os.path.join(path_raw_images, f"{nx}_{ny}_raw.png")
-            img_chunk = Image.open(path_img_chunk)
-            img_chunk = img_chunk.resize((downsampled_img_full_size_x_px, downsampled_img_full_size_y_px), resample=Image.Resampling.BILINEAR)
-            img_chunk = img_chunk.crop(croparea)
-
-            # TODO: make contrast an input parameter
-            filter_contrast = ImageEnhance.Contrast(img_chunk)
-            img_chunk = filter_contrast.enhance(contrast)
+    # feather band is taken from the margin, must stay inside raw image
+    feather = max(0, min(int(feather), downsampled_img_margin_x - 1, downsampled_img_margin_y - 1))
+    tile_size_x_px = downsampled_img_chunk_size_x_px + 2*feather
+    tile_size_y_px = downsampled_img_chunk_size_y_px + 2*feather
+
+    # crop area in raw image coordinates, so only the kept center region of
+    # each raw image is resized (instead of resizing full image then cropping)
+    scale_x = float(config["img_size_x"]) / downsampled_img_full_size_x_px
+    scale_y = float(config["img_size_y"]) / downsampled_img_full_size_y_px
+    croparea_raw = (
+        (croparea[0] - feather) * scale_x,
+        (croparea[1] - feather) * scale_y,
+        (croparea[2] + feather) * scale_x,
+        (croparea[3] + feather) * scale_y,
+    )
 
-            x0 = nx * downsampled_img_chunk_size_x_px
-            y0 = ny * downsampled_img_chunk_size_y_px
-            img.paste(img_chunk, box=(x0, y0))
+    # stitch images together starting from top-left. tiles are written
+    # directly into a numpy image buffer, converted to PIL image once at end
+    img_size_y_px = count_y * downsampled_img_chunk_size_y_px
+    img_size_x_px = count_x * downsampled_img_chunk_size_x_px
+
+    if feather > 0:
+        # raised cosine ramp over the 2*feather px overlap band. ramps of
+        # two neighbouring tiles sum to 1 at each overlapping pixel
+        t = (np.arange(2*feather, dtype=np.float32) + 0.5) / (2*feather)
+        ramp = 0.5 - 0.5*np.cos(np.pi * t)
+        def tile_weights(n):
+            w = np.ones((n,), dtype=np.float32)
+            w[:2*feather] = ramp
+            w[-2*feather:] = ramp[::-1]
+            return w
+        tile_weight = np.outer(tile_weights(tile_size_y_px), tile_weights(tile_size_x_px))
+
+        # weighted sum of tiles and sum of weights, normalized at end
+        img_acc = np.zeros((img_size_y_px, img_size_x_px, 3), dtype=np.float32)
+        img_weight = np.zeros((img_size_y_px, img_size_x_px), dtype=np.float32)
+        blend_lock = threading.Lock()
+    else:
+        img_buffer = np.zeros((img_size_y_px, img_size_x_px, 3), dtype=np.uint8)
+
+    def stitch_tile(nx, ny):
+        path_img_chunk = path_tiles.get((nx, ny)) or os.path.join(path_raw_images, f"{nx}_{ny}_raw.png")
+        img_chunk = Image.open(path_img_chunk).convert("RGB")
+        # box filter averages source pixels in each output pixel area (same as
+        # opencv INTER_AREA), faster and less aliasing than bilinear for downsampling
+        img_chunk = img_chunk.resize((tile_size_x_px, tile_size_y_px), resample=Image.Resampling.BOX, box=croparea_raw)
+        chunk = np.asarray(img_chunk)
+
+        # TODO: make contrast an input parameter
+        # same as PIL `ImageEnhance.Contrast`: blend towards mean grayscale
+        # level of chunk (ITU-R 601-2 luma, as in PIL "L" conversion). blend
+        # only depends on uint8 pixel value, so apply as 256 entry lookup table
+        # (luma is linear so mean luma = luma of mean color, no per pixel
+        # float intermediate, chunk stays uint8 throughout)
+        mean = int(np.dot(chunk.mean(axis=(0, 1)), [0.299, 0.587, 0.114]) + 0.5)
+        lut = np.clip(mean + contrast * (np.arange(256, dtype=np.float32) - mean), 0, 255).astype(np.uint8)
+        chunk = lut[chunk]
+
+        x0 = nx * downsampled_img_chunk_size_x_px
+        y0 = ny * downsampled_img_chunk_size_y_px
+
+        if feather > 0:
+            # tile extends feather px past its chunk, clip to output image
+            x0 -= feather
+            y0 -= feather
+            tx0 = max(0, -x0)
+            ty0 = max(0, -y0)
+            tx1 = min(tile_size_x_px, img_size_x_px - x0)
+            ty1 = min(tile_size_y_px, img_size_y_px - y0)
+            w = tile_weight[ty0:ty1, tx0:tx1]
+            weighted = chunk[ty0:ty1, tx0:tx1] * w[..., None]
+            # neighbouring tiles overlap, accumulate under lock
+            with blend_lock:
+                img_acc[y0+ty0:y0+ty1, x0+tx0:x0+tx1] += weighted
+                img_weight[y0+ty0:y0+ty1, x0+tx0:x0+tx1] += w
+        else:
+            # each tile writes a disjoint region of buffer, safe across threads
+            img_buffer[y0:y0+chunk.shape[0], x0:x0+chunk.shape[1]] = chunk
+
+    # tiles are independent, png decode and resize release the GIL so
+    # process tiles in parallel threads
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        tiles = [ executor.submit(stitch_tile, nx, ny) for nx in range(count_x) for ny in range(count_y) ]
+        for tile in tiles:
+            tile.result() # re-raise any tile errors
     
+    if feather > 0:
+        img_acc /= img_weight[..., None]
+        img_buffer = (img_acc + 0.5).astype(np.uint8)
+
+    img = Image.fromarray(img_buffer)
     path_img_combined_out = os.path.join(path_out, "die_photo.png")
     img.save(path_img_combined_out)
 
@@ -321,6 +458,8 @@ def take_die_photo(
     margin: float = 0.2,    # margin on each side that is ignored
     downsample: int = 2.0,  # downsampling factor for images
     format: str = "png",
+    jobs: int = None,       # number of threads for stitching tiles
+    feather: int = 0,       # tile blend width in output px, 0 -> hard crop
 ):
     """Do a sweep to get a die photo over input x, y size range.
     Note: using PIL which uses top-left origin, e.g.
@@ -342,6 +481,7 @@ def take_die_photo(
         |__________________|
     """
     from math import ceil
+    from concurrent.futures import ThreadPoolExecutor
 
     path_to_img_dir_on_network = config["path_to_img_dir_on_network"]
     path_to_img_dir_on_remote = config["path_to_img_dir_on_remote"]
@@ -378,47 +518,68 @@ def take_die_photo(
     path_die_photo_raw = os.path.join(path_die_photo, "raw")
     os.makedirs(path_die_photo_raw, exist_ok=True)
 
-    controller = SimpleCascadeController(config["gpib_address"])
-
-    # mark home
-    controller.set_chuck_home()
-
-    # sweep array and take image
-    n = 1
-    for nx in range(count_x):
-        for ny in range(count_y):
-            img_name = f"{nx}_{ny}.png"
-            img_raw_name = f"{img_name[:-4]}_raw.png"
-
-            # path to save image locally on the remote computer
-            path_to_save_img_remote = os.path.join(path_to_img_dir_on_remote, img_name)
-
-            # remote directory paths, e.g. \\GAX1-PROBE\shared\gax_tmp_img
-            path_img_remote = os.path.join(path_to_img_dir_on_network, img_name)
-            path_img_remote_raw = os.path.join(path_to_img_dir_on_network, img_raw_name)
-
-            # local computer output paths
-            path_img_out = os.path.join(path_die_photo_raw, img_name)
-            path_img_out_raw = os.path.join(path_die_photo_raw, img_raw_name)
-
-            # offsets relative to home position on top-left
-            dx = dx0_um + nx * img_sixe_x_um
-            dy = dy0_um + (count_y - 1 - ny) * img_size_y_um
+    # images only appear on remote file system seconds after snap, so wait
+    # for and move images in a background thread while stage moves to next
+    # location and snaps next image (gpib calls stay on this thread)
+    image_mover = ThreadPoolExecutor(max_workers=1)
+    moved_images = []
+
+    try:
+        # connection closed on exit, including on errors during sweep
+        with SimpleCascadeController(config["gpib_address"]) as controller:
+            # mark home
+            controller.set_chuck_home()
+
+            # sweep array and take image
+            n = 1
+            for nx in range(count_x):
+                for ny in range(count_y):
+                    img_name = f"{nx}_{ny}.png"
+                    img_raw_name = f"{img_name[:-4]}_raw.png"
+
+                    # path to save image locally on the remote computer
+                    path_to_save_img_remote = os.path.join(path_to_img_dir_on_remote, img_name)
+
+                    # remote directory paths, e.g. \\GAX1-PROBE\shared\gax_tmp_img
+                    path_img_remote = os.path.join(path_to_img_dir_on_network, img_name)
+                    path_img_remote_raw = os.path.join(path_to_img_dir_on_network, img_raw_name)
+
+                    # local computer output paths
+                    path_img_out = os.path.join(path_die_photo_raw, img_name)
+                    path_img_out_raw = os.path.join(path_die_photo_raw, img_raw_name)
+
+                    # offsets relative to home position on top-left
+                    dx = dx0_um + nx * img_sixe_x_um
+                    dy = dy0_um + (count_y - 1 - ny) * img_size_y_um
             
-            # print(dx, dy)
+                    # print(dx, dy)
 
-            controller.move_chuck_relative_to_home(dx, dy)
-            controller.snap_image(config["calibration"][zoom]["name"], path_to_save_img_remote)
+                    # wait for move to finish so stage is settled before snap
+                    controller.move_chuck_relative_to_home(dx, dy)
+                    controller.snap_image(config["calibration"][zoom]["name"], path_to_save_img_remote)
 
-            print(f"Saving img {n}/{total_count}: {path_img_out_raw}")
-            move_image_from_remote_when_ready(path_img_remote, path_img_out)
-            move_image_from_remote_when_ready(path_img_remote_raw, path_img_out_raw)
+                    # fail fast if an earlier image move failed (single mover
+                    # thread, so futures complete in order)
+                    while len(moved_images) > 0 and moved_images[0].done():
+                        moved_images.pop(0).result()
 
-            n += 1
+                    print(f"Saving img {n}/{total_count}: {path_img_out_raw}")
+                    moved_images.append(image_mover.submit(move_images_from_remote_when_ready, [
+                        (path_img_remote, path_img_out),
+                        (path_img_remote_raw, path_img_out_raw),
+                    ]))
+
+                    n += 1
     
-    # move back to home position
-    controller.move_to_chuck_home()
-    controller.close()
+            # move back to home position
+            controller.move_to_chuck_home()
+
+        # wait for remaining images, re-raises any image timeout errors
+        for moved in moved_images:
+            moved.result()
+    finally:
+        # on errors, drop queued image moves instead of waiting for them
+        image_mover.shutdown(cancel_futures=True)
 
     stitch_images(
         config=config,
@@ -429,6 +590,8 @@ def take_die_photo(
         downsample=downsample,
         format=format,
         show_image=True,
+        jobs=jobs,
+        feather=feather,
     )
 
 
@@ -439,8 +602,6 @@ def take_image(
     format: str = "png",
 ):
     """Take single image snapshot and save to output directory."""
-    controller = SimpleCascadeController(config["gpib_address"])
-
     path_to_img_dir_on_network = config["path_to_img_dir_on_network"]
     path_to_img_dir_on_remote = config["path_to_img_dir_on_remote"]
 
@@ -451,16 +612,18 @@ def take_image(
     img_raw_name = f"snapshot_zoom_{zoom}_raw.{format}" # raw image has no labels
 
     path_to_save_img_remote = os.path.join(path_to_img_dir_on_remote, img_name)
-    controller.snap_image(config["calibration"][zoom]["name"], path_to_save_img_remote)
-    controller.close()
+    with SimpleCascadeController(config["gpib_address"]) as controller:
+        controller.snap_image(config["calibration"][zoom]["name"], path_to_save_img_remote)
 
     # copy image to local output
     path_img_remote = os.path.join(path_to_img_dir_on_network, img_name)
     path_img_out = os.path.join(path_out, img_name)
     path_img_remote_raw = os.path.join(path_to_img_dir_on_network, img_raw_name)
     path_img_out_raw = os.path.join(path_out, img_raw_name)
-    move_image_from_remote_when_ready(path_img_remote, path_img_out)
-    move_image_from_remote_when_ready(path_img_remote_raw, path_img_out_raw)
+    move_images_from_remote_when_ready([
+        (path_img_remote, path_img_out),
+        (path_img_remote_raw, path_img_out_raw),
+    ])
     print(f"Saved image to: {path_img_out}")
 
 if __name__ == "__main__":
@@ -512,6 +675,23 @@ if __name__ == "__main__":
         default=2,
         help="Set downsampling factor for stitched panorama. Default downscaling is 2x."
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        metavar="JOBS",
+        dest="jobs",
+        type=int,
+        default=None,
+        help="Number of threads for stitching image tiles. Default uses thread pool default (based on cpu count)."
+    )
+    parser.add_argument(
+        "--feather",
+        metavar="PX",
+        dest="feather",
+        type=int,
+        default=0,
+        help="Blend neighbouring tiles over PX output pixels of their margin on each edge (cosine cross-fade). Default 0 uses hard cropped edges."
+    )
     parser.add_argument(
         "--stitch",
         dest="stitch",
@@ -539,6 +719,8 @@ if __name__ == "__main__":
             path_out=args.path_out,
             downsample=args.downsample,
             show_image=True,
+            jobs=args.jobs,
+            feather=args.feather,
         )
     else: # will take new images and stitch together
         zoom = args.zoom
@@ -562,4 +744,6 @@ if __name__ == "__main__":
                 size_y=y,
                 path_out=args.path_out,
                 downsample=args.downsample,
+                jobs=args.jobs,
+                feather=args.feather,
             )
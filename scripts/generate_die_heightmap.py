@@ -13,7 +13,6 @@ at each die.
 
 import numpy as np
 import tomli
-from scipy.optimize import curve_fit
 
 def wafer_height_model(
     xy,
@@ -54,9 +53,57 @@ def wafer_height_model(
         x = xy[0]
         y = xy[1]
 
-    theta = np.arctan2(x, y)
     r = np.sqrt((x**2) + (y**2))
-    return a*x + b*y + c0* r * (d0 + (d1*np.cos(4*theta)))
+    return a*x + b*y + c0* r * (d0 + (d1*cos_4theta(x, y)))
+
+
+def cos_4theta(x, y):
+    """Return cos(4*theta) of points (x, y) from double angle identity
+    cos(4*theta) = 2*cos(2*theta)^2 - 1, cos(2*theta) = (x^2 - y^2)/r^2,
+    without arctan2/cos. Returns 0 at origin (cos(4*theta) term is always
+    scaled by r in model, so has no contribution there).
+    """
+    x2 = np.multiply(x, x)
+    y2 = np.multiply(y, y)
+    r2 = x2 + y2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cos_2theta = np.where(r2 > 0.0, (x2 - y2) / r2, 0.0)
+    return np.where(r2 > 0.0, 2.0*cos_2theta*cos_2theta - 1.0, 0.0)
+
+
+def wafer_height_model_basis(xy: np.ndarray) -> np.ndarray:
+    """Return (N, 4) basis matrix [x, y, r, r*cos(4*theta)] for (N, 2)
+    points `xy`. With `alpha = c0*d0`, `beta = c0*d1` the (used terms of
+    the) model `wafer_height_model` is linear in its coefficients:
+        h = basis @ [a, b, alpha, beta]
+    """
+    x = xy[:, 0]
+    y = xy[:, 1]
+    r = np.hypot(x, y)
+    return np.column_stack((x, y, r, r * cos_4theta(x, y)))
+
+
+def fit_wafer_height_model(
+    xy: np.ndarray,
+    h: np.ndarray,
+):
+    """Fit `wafer_height_model` to (N, 2) points `xy` with heights `h`.
+    Model is linear in (a, b, alpha = c0*d0, beta = c0*d1), so fit is a
+    single closed form linear least squares solve on the basis from
+    `wafer_height_model_basis` (no iterative solver). Returns model
+    parameters (a, b, c0, c1, d0, d1), with c0, d0, d1 normalized so that
+    d0 + |d1| = 1 (c1 is not used by model, returned as 0).
+    """
+    basis = wafer_height_model_basis(xy)
+    (a, b, alpha, beta), _, _, _ = np.linalg.lstsq(basis, h, rcond=None)
+    c0 = abs(alpha) + abs(beta)
+    if c0 > 0.0:
+        d0 = alpha / c0
+        d1 = beta / c0
+    else:
+        d0 = 1.0
+        d1 = 0.0
+    return a, b, c0, 0.0, d0, d1
 
 
 def run_fit_test():
@@ -103,19 +150,7 @@ def run_fit_test():
     print(f"points_h={points_h}")
 
     # fit model to points
-    popt, pcov = curve_fit(
-        wafer_height_model,
-        points_xy,
-        points_h,
-        p0=[1, 1, 1, 1, 1, 0],
-        bounds=[
-            [-np.inf, -np.inf,     0.0,    0.0, 0.0, -1.0],
-            [ np.inf,  np.inf,  np.inf, np.inf, 1.0, 1.0],
-        ],
-        )
-
-    # unpack fitted parameters
-    a_fit, b_fit, c0_fit, c1_fit, d0_fit, d1_fit = popt
+    a_fit, b_fit, c0_fit, c1_fit, d0_fit, d1_fit = fit_wafer_height_model(points_xy, points_h)
 
     # generate height from fitted parameters
     points_h_fit = wafer_height_model(points_xy, a_fit, b_fit, c0_fit, c1_fit, d0_fit, d1_fit)
@@ -160,19 +195,15 @@ def test_create_heightmap(
         toml_dict = tomli.load(f)
         print(toml_dict)
         
-        # fill arrays of points and height offsets
-        num_points = len(toml_dict["die_height_offset"])
-        x_vals = np.full((num_points,), np.nan)
-        y_vals = np.full((num_points,), np.nan)
-        dz_vals = np.full((num_points,), np.nan)
-
-        # each measurement is in format like {x: -1.0, y: -2.0, dz: -4}
-        for i, x_y_dz in enumerate(toml_dict["die_height_offset"]):
-            x, y, dz = x_y_dz.values()
-            print(x, y, dz)
-            x_vals[i] = x
-            y_vals[i] = y
-            dz_vals[i] = dz
+        # each measurement is in format like {x: -1.0, y: -2.0, dz: -4},
+        # read by key so order of keys in file does not matter
+        measurements = np.array(
+            [ [p["x"], p["y"], p["dz"]] for p in toml_dict["die_height_offset"] ],
+            dtype=np.float64,
+        ).reshape(-1, 3)
+        x_vals = measurements[:, 0]
+        y_vals = measurements[:, 1]
+        dz_vals = measurements[:, 2]
         
         print("x_vals", x_vals)
         print("y_vals", y_vals)
@@ -183,11 +214,13 @@ def test_create_heightmap(
         y_sample = np.array([3, 2, 1, 0, -1, -2, -3])
 
         # 1. scipy.interpolate.interp2d (fits coefficients)
+        # evaluate whole grid in one call, interp2d returns rows in sorted
+        # y order so reorder back to y_sample order
         die_dz_interp2d = interp2d(x_vals, y_vals, dz_vals, kind="cubic")
-        dz_table = []
-        for y in y_sample:
-            dz = np.minimum(0.0, die_dz_interp2d(x_sample, y)) # force clamp to 0.0 max
-            dz_table.append(dz)
+        y_order = np.argsort(y_sample)
+        dz_table = np.empty((len(y_sample), len(x_sample)))
+        dz_table[y_order] = die_dz_interp2d(x_sample, y_sample[y_order])
+        dz_table = np.minimum(0.0, dz_table) # force clamp to 0.0 max
         print("USING scipy.interpolate.interp2d (fits coefficients)")
         print(tabulate(dz_table))
 
@@ -196,10 +229,9 @@ def test_create_heightmap(
             np.concatenate((x_vals[:, None], y_vals[:, None]), axis=1),
             dz_vals,
         )
-        dz_table2 = []
-        for y in y_sample:
-            dz = np.minimum(0.0, die_dz_ct_interp2d(x_sample, y))
-            dz_table2.append(dz)
+        # evaluate whole (y, x) grid in one call
+        x_grid, y_grid = np.meshgrid(x_sample, y_sample)
+        dz_table2 = np.minimum(0.0, die_dz_ct_interp2d(x_grid, y_grid))
         print("USING scipy.interpolate.CloughTocher2DInterpolator (ensures points match)")
         print(tabulate(dz_table2))
 
@@ -0,0 +1,64 @@
+"""
+Convert measurement .h5 result files into matlab .mat files.
+Measurement sweeps save a .mat copy of results by default, unless
+disabled with `export_mat = false` in program config. Use this to
+generate .mat files afterwards for results saved without them, e.g.
+for matlab plotting scripts.
+
+Converts a single .h5 file, or recursively converts all .h5 files
+in a folder (each .mat is saved next to its .h5 file).
+"""
+
+import os
+
+def h5_to_mat(
+    path: str,
+    overwrite: bool = False,
+):
+    """Convert .h5 file at `path` to .mat file with same name.
+    Returns output .mat path, or None if skipped."""
+    from controller.util.io import import_hdf5, export_mat
+
+    path_mat = os.path.splitext(path)[0] + ".mat"
+    if not overwrite and os.path.exists(path_mat):
+        return None
+    export_mat(path_mat, import_hdf5(path))
+    return path_mat
+
+def convert_folder(
+    path: str,
+    overwrite: bool = False,
+):
+    """Recursively convert all .h5 files in folder to .mat files."""
+    for root, dirs, files in os.walk(path):
+        for f in files:
+            if f.endswith(".h5"):
+                path_mat = h5_to_mat(os.path.join(root, f), overwrite=overwrite)
+                if path_mat is not None:
+                    print(f"Saved: {path_mat}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Convert measurement .h5 files to .mat files.")
+
+    parser.add_argument(
+        "path",
+        metavar="path",
+        type=str,
+        help="Path to .h5 file or folder of measurements (searched recursively)"
+    )
+    parser.add_argument(
+        "--overwrite",
+        dest="overwrite",
+        action="store_true",
+        help="Overwrite existing .mat files"
+    )
+
+    args = parser.parse_args()
+
+    if os.path.isdir(args.path):
+        convert_folder(args.path, overwrite=args.overwrite)
+    else:
+        print(f"Saved: {h5_to_mat(args.path, overwrite=True)}")
@@ -37,8 +37,16 @@ We want to merge this data into a `_merged` folder:
 
 """
 
+import re
 from collections import defaultdict
 from dataclasses import dataclass
+from operator import attrgetter
+
+# measurement folder name "gax_[tag]_[timestamp]"
+MEASUREMENT_NAME_RE = re.compile(r"gax_(?P<tag>.*)_(?P<timestamp>\d{4}(?:_\d{2}){5})")
+# row "r0" and col "c0" in tag, e.g. "r0_c1" or "c1_r0"
+MEASUREMENT_ROW_RE = re.compile(r"(?:^|_)r(\d+)(?=_|$)")
+MEASUREMENT_COL_RE = re.compile(r"(?:^|_)c(\d+)(?=_|$)")
 
 @dataclass
 class ModuleMeasurement:
@@ -53,24 +61,27 @@ class ModuleMeasurement:
         e.g.
         gax_mod_fet_tlm_nmos_lc_0.12_lch_0.10_lov_0.06_gateasym_0.00_w_4.0_6_2023_07_01_04_39_24
     """
+    # explicit slots (no per instance __dict__), fields have no defaults
+    # so this works with plain @dataclass (slots=True requires python 3.10)
+    __slots__ = ("filename", "timestamp", "row", "col")
+
     filename: str
     timestamp: str
     row: int
     col: int
 
     def from_filename(filename: str):
-        timestamp = filename[-19:]
-        tag = filename[4:-20]
+        m = MEASUREMENT_NAME_RE.fullmatch(filename)
+        if m is None:
+            raise ValueError(f"Invalid measurement folder name: {filename}")
+        timestamp = m.group("timestamp")
+        tag = m.group("tag")
         
         # find row and col
-        chunks = tag.split("_")
-        row = None
-        col = None
-        for s in chunks:
-            if s.startswith("r"):
-                row = int(s[1:])
-            elif s.startswith("c"):
-                col = int(s[1:])
+        m_row = MEASUREMENT_ROW_RE.search(tag)
+        m_col = MEASUREMENT_COL_RE.search(tag)
+        row = int(m_row.group(1)) if m_row is not None else None
+        col = int(m_col.group(1)) if m_col is not None else None
 
         return ModuleMeasurement(
             filename=filename,
@@ -79,67 +90,73 @@ class ModuleMeasurement:
             col=col,
         )
 
+def merge_and_export_hdf5(
+    paths: list,
+    path_out: str,
+):
+    """Merge device measurement .h5 files in `paths` (in order) and save
+    merged data to `path_out`. Top-level function so it can run in a
+    process pool worker.
+    """
+    from controller.util.io import merge_hdf5, export_hdf5
+    # chunk by device, merged data is usually read per device
+    export_hdf5(path_out, merge_hdf5(paths), row_chunks=True)
+
 def merge_multidie_module_data(
     path: str,
     program: str = "keysight_id_vgs",
+    processes: int = None,
 ):
-    import numpy as np
+    """Merge measurements in each die, see module docstring. Each merged
+    file is independent, so files are merged in parallel in a process pool
+    of `processes` workers (None -> cpu count, 1 -> merge serially).
+    """
     import os
-    from controller.util.io import import_hdf5, export_hdf5, export_mat
+    from multiprocessing import Pool
     
     path_out = os.path.join(path, "_merged")
     os.makedirs(path_out, exist_ok=True)
 
-    print(os.listdir(path))
-    for d in os.listdir(path):
-        if not d.startswith("die"):
-            continue
-        path_die = os.path.join(path, d)
+    # list of (input .h5 paths, output .h5 path) for each merged file
+    jobs = []
+    program_filename = f"{program}.h5"
+
+    # die folders, single directory scan (entry type comes from the scan,
+    # no stat per entry)
+    with os.scandir(path) as entries:
+        dies = [ (e.name, e.path) for e in entries if e.name.startswith("die") and e.is_dir() ]
+    print([ d for d, _ in dies ])
+
+    for d, path_die in dies:
         print(d, path_die)
 
         # map die measurements row => col list
         die_measurements = defaultdict(list)
 
-        for measurement_path in os.listdir(path_die):
-            if not measurement_path.startswith("gax"):
-                continue
+        with os.scandir(path_die) as entries:
+            measurement_paths = [ e.name for e in entries if e.name.startswith("gax") and e.is_dir() ]
+
+        for measurement_path in measurement_paths:
             measurement = ModuleMeasurement.from_filename(measurement_path)
             die_measurements[measurement.row].append(measurement)
 
         # sort measurements by row and col
         for row, measurements in die_measurements.items():
-            measurements.sort(key=lambda x: x.col)
+            measurements.sort(key=attrgetter("col"))
         
         # merge measurements into single .h5 file
         # TODO: merge all measurements, not just idvg
         for row, measurements in die_measurements.items():
-            num_devices = len(measurements)
-
-            # load first measurement to find data shape
-            data0 = import_hdf5(os.path.join(path_die, measurements[0].filename, f"{program}.h5"))
-            data_shape = data0["i_d"].shape
-
-            # make merged data for all keys (i_d, v_gs, v_ds, etc.)
-            data_merged = {}
-            for k, v in data0.items():
-                if type(v) is np.ndarray:
-                    if len(v.shape) > 1:
-                        # alloc new array for all files, will be filled later
-                        data_merged[k] = np.full((num_devices, data_shape[0], data_shape[1], data_shape[2]), np.nan)
-                    else: # common properties
-                        data_merged[k] = v
-                else:
-                    data_merged[k] = v
-            
-            # insert numpy array data into merged arrays
-            for i, measured in enumerate(measurements):
-                data_i = import_hdf5(os.path.join(path_die, measured.filename, f"{program}.h5"))
-                for k, v in data_i.items():
-                    if type(v) is np.ndarray and len(v.shape) > 1:
-                        data_merged[k][i,:] = v
-            
+            paths_measured = [ os.path.join(path_die, measured.filename, program_filename) for measured in measurements ]
             path_out_merged = os.path.join(path_out, f"{d}_r{row}")
-            export_hdf5(path_out_merged + ".h5", data_merged)
+            jobs.append((paths_measured, path_out_merged + ".h5"))
+    
+    if processes == 1:
+        for job in jobs:
+            merge_and_export_hdf5(*job)
+    else:
+        with Pool(processes=processes) as pool:
+            pool.starmap(merge_and_export_hdf5, jobs)
 
 
 if __name__ == "__main__":
@@ -163,6 +180,16 @@ if __name__ == "__main__":
         help="Measurement program type name, e.g. keysight_id_vgs or keysight_id_vds"
     )
 
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        metavar="JOBS",
+        dest="processes",
+        type=int,
+        default=None,
+        help="Number of processes merging files in parallel. Default uses cpu count."
+    )
+
     args = parser.parse_args()
 
     path = args.path
@@ -174,4 +201,5 @@ if __name__ == "__main__":
     merge_multidie_module_data(
         path=path,
         program=program,
+        processes=args.processes,
     )
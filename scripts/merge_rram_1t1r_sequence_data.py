@@ -1,6 +1,7 @@
 def merge_rram_1t1r_sequence_data(
     path_in,
     path_out,
+    save_mat: bool = True,
 ):
     """Merge all 1T1R repeated sequence data into single file.
     Each data in folder should be .h5 file in format:
@@ -9,52 +10,31 @@ def merge_rram_1t1r_sequence_data(
         keysight_rram_1t1r_sequence_2.h5
         ...
     Take all these files, sort by number at end, then merge into
-    single .h5 file, write to path_out.
+    single .h5 file, write to path_out. If `save_mat`, also write a
+    matlab .mat copy of the merged data.
     """
     import os
     import json
-    import numpy as np
-    from controller.util.io import import_hdf5, export_hdf5, export_mat
+    from controller.util.io import merge_hdf5, export_hdf5, export_mat
 
     # get list of sorted files by sequence run number
+    # (run number is after last "_" in filename without .h5)
     data_files = [ p for p in os.listdir(path_in) if p.endswith(".h5") ]
-    data_filenames = [ p[:-3] for p in data_files ]
-    data_ids = np.array([ int(p.split("_")[-1]) for p in data_filenames ])
-    idx_sorted = np.argsort(data_ids)
-    data_files_sorted = [ data_files[i] for i in idx_sorted ]
+    data_files_sorted = sorted(data_files, key=lambda p: int(p[:-3].rpartition("_")[2]))
 
     # merge sorted files
-    
-    # load first file, figure out data shape and insert non-zero shapes
     num_steps = len(data_files_sorted)
-    data0 = import_hdf5(os.path.join(path_in, data_files_sorted[0]))
-    data_shape = data0["i_d"].shape
-    print(f"data_shape = {data_shape}")
-    data_merged = {}
-    for k, v in data0.items():
-        if type(v) is np.ndarray:
-            if len(v.shape) > 1:
-                # alloc new array for all files, fill first row
-                data_merged[k] = np.full((num_steps, data_shape[0], data_shape[1], data_shape[2]), np.nan)
-                data_merged[k][0,:] = v
-            else: # common properties
-                data_merged[k] = v
-        else:
-            data_merged[k] = v
-    
-    for i, p in enumerate(data_files_sorted[1:]):
-        print(i, p)
-        data_step = import_hdf5(os.path.join(path_in, p))
-        for k, v in data_step.items():
-            if type(v) is np.ndarray and len(v.shape) > 1:
-                data_merged[k][i+1,:] = v
+    data_merged = merge_hdf5([ os.path.join(path_in, p) for p in data_files_sorted ])
+    print(f"data_shape = {data_merged['i_d'].shape[1:]}")
     
     # save output
     n_start = 0
     n_end = num_steps
     path_out_merged = os.path.join(path_out, f"keysight_rram_1t1r_sequence_merged_{n_start}_to_{n_end}")
-    export_hdf5(path_out_merged + ".h5", data_merged)
-    export_mat(path_out_merged + ".mat", data_merged)
+    # chunk by sequence step, merged data is usually read per step
+    export_hdf5(path_out_merged + ".h5", data_merged, row_chunks=True)
+    if save_mat:
+        export_mat(path_out_merged + ".mat", data_merged)
     
 
 if __name__ == "__main__":
@@ -78,6 +58,12 @@ if __name__ == "__main__":
         type=str,
         help="Folder to put merged data file"
     )
+    parser.add_argument(
+        "--no-mat",
+        dest="save_mat",
+        action="store_false",
+        help="Skip writing .mat copy of merged data (only write .h5)"
+    )
 
     args = parser.parse_args()
 
@@ -90,4 +76,5 @@ if __name__ == "__main__":
     merge_rram_1t1r_sequence_data(
         path_in=path_in,
         path_out=path_out,
+        save_mat=args.save_mat,
     )
@@ -0,0 +1,123 @@
+"""
+Tests for data import/export utilities.
+"""
+
+import os
+import tempfile
+import unittest
+import h5py
+import numpy as np
+import controller.util.io as io
+from controller.util.io import export_hdf5, import_hdf5, hdf5_value, merge_hdf5
+
+class TestExportHdf5(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.data = {
+            "v_gs": np.linspace(-1.0, 1.0, 11),
+            "i_d": np.random.default_rng(0).random((4, 3, 20000)),
+            "step": 3,
+            "name": "debug",
+        }
+
+    def check_round_trip(self, path):
+        d = import_hdf5(path)
+        self.assertEqual(set(d.keys()), set(self.data.keys()))
+        np.testing.assert_array_equal(d["v_gs"], self.data["v_gs"])
+        np.testing.assert_array_equal(d["i_d"], self.data["i_d"])
+        self.assertEqual(d["step"], 3)
+        self.assertEqual(d["name"], b"debug")
+
+    def test_file_image_round_trip(self):
+        path = os.path.join(self.tmp.name, "small.h5")
+        export_hdf5(path, self.data)
+        self.check_round_trip(path)
+        with h5py.File(path, "r") as h5:
+            # large array chunked and compressed
+            self.assertIsNotNone(h5["i_d"].chunks)
+            self.assertEqual(h5["i_d"].compression, "gzip")
+            self.assertIsNone(h5["v_gs"].chunks)
+
+    def test_direct_write_round_trip(self):
+        # force direct (locking=False) write path instead of in memory image
+        max_bytes = io.HDF5_FILE_IMAGE_MAX_BYTES
+        io.HDF5_FILE_IMAGE_MAX_BYTES = 0
+        self.addCleanup(setattr, io, "HDF5_FILE_IMAGE_MAX_BYTES", max_bytes)
+        path = os.path.join(self.tmp.name, "large.h5")
+        export_hdf5(path, self.data, row_chunks=True)
+        self.check_round_trip(path)
+        with h5py.File(path, "r") as h5:
+            self.assertEqual(h5["i_d"].chunks[1:], (3, 20000))
+
+    def test_hdf5_value_fixed_length_strings(self):
+        for val in [np.array(["a", "bc", "µA"]), np.array(["a", "bc", "µA"], dtype=object)]:
+            out = hdf5_value(val)
+            self.assertEqual(out.dtype.kind, "S")
+            self.assertEqual([s.decode("utf-8") for s in out], ["a", "bc", "µA"])
+
+        path = os.path.join(self.tmp.name, "str.h5")
+        export_hdf5(path, {"units": np.array(["V", "µA"], dtype=object)})
+        with h5py.File(path, "r") as h5:
+            # fixed-length (not variable-length) byte strings
+            self.assertEqual(h5py.check_string_dtype(h5["units"].dtype).length, 3)
+            self.assertEqual([s.decode("utf-8") for s in h5["units"][:]], ["V", "µA"])
+
+    def test_hdf5_value_passthrough(self):
+        x = np.arange(3)
+        self.assertIs(hdf5_value(x), x)
+        mixed = np.array(["a", 1], dtype=object)
+        self.assertIs(hdf5_value(mixed), mixed)
+        self.assertEqual(hdf5_value("text"), "text")
+
+class TestMergeHdf5(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def write_devices(self, num, shape=(2, 5)):
+        paths = []
+        for i in range(num):
+            path = os.path.join(self.tmp.name, f"gax_{i}.h5")
+            export_hdf5(path, {
+                "v_ds": np.linspace(0.0, 1.0, 5),
+                "i_d": np.full(shape, i, dtype=np.float32),
+                "step": 2,
+            })
+            paths.append(path)
+        return paths
+
+    def test_merge_stacks_rows_in_order(self):
+        # fewer read threads than files, so prefetch window refills
+        threads = io.HDF5_MERGE_READ_THREADS
+        io.HDF5_MERGE_READ_THREADS = 2
+        self.addCleanup(setattr, io, "HDF5_MERGE_READ_THREADS", threads)
+        paths = self.write_devices(7)
+        merged = merge_hdf5(paths)
+        self.assertEqual(merged["i_d"].shape, (7, 2, 5))
+        self.assertEqual(merged["i_d"].dtype, np.float32)
+        self.assertEqual(list(merged["i_d"][:, 0, 0]), list(range(7)))
+        # common values taken from first file
+        np.testing.assert_array_equal(merged["v_ds"], np.linspace(0.0, 1.0, 5))
+        self.assertEqual(merged["step"], 2)
+
+    def test_merge_single_file(self):
+        merged = merge_hdf5(self.write_devices(1))
+        self.assertEqual(merged["i_d"].shape, (1, 2, 5))
+
+    def test_merge_shape_mismatch(self):
+        paths = self.write_devices(2)
+        path_bad = os.path.join(self.tmp.name, "bad.h5")
+        export_hdf5(path_bad, {"v_ds": np.zeros(5), "i_d": np.zeros((3, 5), dtype=np.float32), "step": 2})
+        with self.assertRaises(ValueError):
+            merge_hdf5([*paths, path_bad])
+
+    def test_merge_missing_dataset(self):
+        paths = self.write_devices(2)
+        path_bad = os.path.join(self.tmp.name, "missing.h5")
+        export_hdf5(path_bad, {"v_ds": np.zeros(5), "step": 2})
+        with self.assertRaises(ValueError):
+            merge_hdf5([*paths, path_bad])
+
+if __name__ == '__main__':
+    unittest.main()
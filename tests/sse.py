@@ -0,0 +1,130 @@
+"""
+Tests for SSE event channel.
+"""
+
+import json
+import unittest
+import gevent
+from sys import float_info
+import numpy as np
+import controller.sse as sse
+from controller.sse import SPSCRing, EventChannel, RawJson, json_dumps
+
+class TestSPSCRing(unittest.TestCase):
+    def test_push_pop_order(self):
+        ring = SPSCRing(capacity=4)
+        for i in range(3):
+            ring.push(i)
+        self.assertEqual([ring.pop() for _ in range(3)], [0, 1, 2])
+        self.assertEqual(ring.size, 0)
+    
+    def test_full_overwrites_oldest(self):
+        ring = SPSCRing(capacity=3)
+        for i in range(5):
+            ring.push(i)
+        self.assertEqual(ring.size, 3)
+        self.assertEqual(ring.dropped, 2)
+        self.assertEqual([ring.pop() for _ in range(3)], [2, 3, 4])
+    
+    def test_pop_waits_for_push(self):
+        ring = SPSCRing(capacity=3)
+        def producer():
+            gevent.sleep(0.01)
+            ring.push("event")
+        gevent.spawn(producer)
+        self.assertEqual(ring.pop(), "event")
+
+class TestEventChannel(unittest.TestCase):
+    def subscribe_ring(self, channel):
+        ring = SPSCRing(capacity=8)
+        channel.subscriptions.add(ring)
+        return ring
+    
+    def test_publish_batched_after_flush_interval(self):
+        channel = EventChannel(flush_interval=0.01, flush_size=64)
+        ring = self.subscribe_ring(channel)
+        for i in range(3):
+            channel.publish({"i": i})
+        self.assertEqual(ring.size, 0) # not sent until notifier flushes
+        gevent.sleep(0.05)
+        self.assertEqual(ring.size, 1)
+        self.assertEqual([json.loads(sse.data) for sse in ring.pop()], [{"i": 0}, {"i": 1}, {"i": 2}])
+    
+    def test_publish_flushes_at_flush_size(self):
+        channel = EventChannel(flush_interval=10.0, flush_size=2)
+        ring = self.subscribe_ring(channel)
+        channel.publish({"i": 0})
+        channel.publish({"i": 1})
+        self.assertEqual(ring.size, 1)
+        self.assertEqual(len(ring.pop()), 2)
+    
+    def test_history_replay_after_last_id(self):
+        channel = EventChannel(flush_interval=0.01)
+        for i in range(3):
+            channel.publish({"i": i})
+        last_id = channel.history[-3].event_id # first published event
+        events = channel.event_generator(last_id)
+        replayed = [json.loads(next(events).data) for _ in range(2)]
+        events.close()
+        self.assertEqual(replayed, [{"i": 1}, {"i": 2}])
+        self.assertEqual(len(channel.subscriptions), 0)
+    
+    def test_history_evicted_id_not_replayed(self):
+        channel = EventChannel(history_size=3, flush_interval=0.01)
+        first_id = channel.get_last_id() # start of history event
+        for i in range(5):
+            channel.publish({"i": i})
+        self.assertEqual(len(channel._id_to_seq), 3)
+        ring = SPSCRing(capacity=8)
+        channel._add_history(ring, first_id)
+        self.assertEqual(ring.size, 0)
+        channel._add_history(ring, channel.history[0].event_id)
+        self.assertEqual([json.loads(sse.data) for sse in ring.pop()], [{"i": 3}, {"i": 4}])
+
+class TestJsonDumps(unittest.TestCase):
+    def test_non_finite_sanitized(self):
+        message = {
+            "array": np.array([1.0, np.nan, np.inf, -np.inf]),
+            "scalar": float("nan"),
+            "list": [np.float32("inf"), (2, float("-inf"))],
+        }
+        data = json.loads(json_dumps(message))
+        m = float_info.max
+        self.assertEqual(data["array"], [1.0, m, m, -m])
+        self.assertEqual(data["scalar"], m)
+        self.assertEqual(data["list"], [m, [2, -m]])
+    
+    def test_non_finite_float32_sanitized(self):
+        data = json.loads(json_dumps({
+            "a": np.array([np.nan, 1.0, np.inf, -np.inf], dtype=np.float32),
+            "b": np.array([np.nan], dtype=np.float16),
+        }))
+        m = float_info.max
+        self.assertEqual(data["a"], [m, 1.0, m, -m])
+        self.assertEqual(data["b"], [m])
+    
+    def test_finite_lists_unchanged(self):
+        floats = [0.5 * i for i in range(100)]
+        data = json.loads(json_dumps({"f": floats, "s": ["a", "b"], "i": [1, 2], "n": [None, 1.0, float("nan")]}))
+        self.assertEqual(data["f"], floats)
+        self.assertEqual(data["s"], ["a", "b"])
+        self.assertEqual(data["i"], [1, 2])
+        self.assertEqual(data["n"], [None, 1.0, float_info.max])
+    
+    def test_non_str_keys(self):
+        message = {0: [1.0], np.int64(1): {"v": 2}, 2.5: None, "s": "x"}
+        orjson = sse.orjson
+        self.addCleanup(setattr, sse, "orjson", orjson)
+        for encoder in [orjson, None]: # orjson and standard json fallback
+            sse.orjson = encoder
+            data = json.loads(json_dumps(message))
+            self.assertEqual(data, {"0": [1.0], "1": {"v": 2}, "2.5": None, "s": "x"})
+    
+    def test_str_bytes_raw(self):
+        self.assertEqual(json.loads(json_dumps("text")), "text")
+        self.assertEqual(json.loads(json_dumps(b'{"a": 1}')), {"a": 1})
+        self.assertEqual(json.loads(json_dumps(b"not json")), "not json")
+        self.assertEqual(json_dumps(RawJson('{"a":1}')), '{"a":1}')
+
+if __name__ == '__main__':
+    unittest.main()
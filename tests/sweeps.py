@@ -0,0 +1,87 @@
+"""
+Tests for measurement sweep helpers.
+"""
+
+import os
+import tempfile
+import unittest
+import numpy as np
+from controller.sweeps import array_sweep_plan
+from controller.sweeps.multi_die_array import load_die_height_offset_interp2d, create_die_height_offset_interp2d
+
+class TestArraySweepPlan(unittest.TestCase):
+    def test_row_order(self):
+        rows, cols, xs, ys = array_sweep_plan(2, 3, 1, 0, 10.0, 20.0, sweep_order="row")
+        self.assertEqual(list(zip(rows, cols)), [(1, 0), (1, 1), (1, 2), (2, 0), (2, 1), (2, 2)])
+        self.assertEqual(list(zip(xs, ys)), [(0, 0), (10, 0), (20, 0), (0, 20), (10, 20), (20, 20)])
+    
+    def test_col_order_serpentine(self):
+        rows, cols, xs, ys = array_sweep_plan(3, 2, 0, 0, 10.0, 20.0, sweep_order="col", serpentine=True)
+        self.assertEqual(list(zip(rows, cols)), [(0, 0), (1, 0), (2, 0), (2, 1), (1, 1), (0, 1)])
+        self.assertEqual(list(zip(xs, ys)), [(0, 0), (0, 20), (0, 40), (10, 40), (10, 20), (10, 0)])
+    
+    def test_invalid_sweep_order(self):
+        with self.assertRaises(ValueError):
+            array_sweep_plan(1, 1, 0, 0, 1.0, 1.0, sweep_order="diagonal")
+
+class TestDieHeightOffset(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.path = os.path.join(self.tmp.name, "die_height_offset.toml")
+    
+    def write_offsets(self, points):
+        with open(self.path, "w") as f:
+            f.write("die_height_offset = [\n")
+            for x, y, dz in points:
+                f.write(f"    {{ dz = {dz}, x = {x}, y = {y} }},\n")
+            f.write("]\n")
+    
+    def test_interpolates_through_points(self):
+        points = [(0, 0, -1.0), (2, 0, -2.0), (0, 2, -3.0), (2, 2, -4.0)]
+        self.write_offsets(points)
+        interp2d = load_die_height_offset_interp2d(self.path)
+        for x, y, dz in points:
+            self.assertAlmostEqual(interp2d(x, y), dz)
+        self.assertTrue(-4.0 < interp2d(1, 1) < -1.0)
+        # array input evaluated pointwise
+        np.testing.assert_allclose(interp2d(np.array([0.0, 2.0]), np.array([0.0, 2.0])), [-1.0, -4.0])
+    
+    def test_outside_hull_uses_nearest(self):
+        self.write_offsets([(0, 0, -1.0), (2, 0, -2.0), (0, 2, -3.0)])
+        interp2d = load_die_height_offset_interp2d(self.path)
+        self.assertAlmostEqual(interp2d(5, 0), -2.0)
+        self.assertAlmostEqual(interp2d(0, -5), -1.0)
+    
+    def test_colinear_falls_back_to_nearest(self):
+        self.write_offsets([(0, 0, -1.0), (1, 0, -2.0), (2, 0, -3.0)])
+        interp2d = load_die_height_offset_interp2d(self.path)
+        self.assertAlmostEqual(interp2d(0, 1), -1.0)
+        self.assertAlmostEqual(interp2d(2, 5), -3.0)
+    
+    def test_positive_offsets_clamped(self):
+        self.write_offsets([(0, 0, 1.0), (2, 0, -2.0), (0, 2, 3.0)])
+        interp2d = load_die_height_offset_interp2d(self.path)
+        self.assertEqual(interp2d(0, 0), 0.0)
+        self.assertAlmostEqual(interp2d(2, 0), -2.0)
+    
+    def test_empty_file_zero_offsets(self):
+        with open(self.path, "w") as f:
+            f.write("die_height_offset = []\n")
+        interp2d = load_die_height_offset_interp2d(self.path)
+        self.assertEqual(interp2d(3, 4), 0.0)
+        np.testing.assert_array_equal(interp2d(np.array([1.0, 2.0]), np.array([1.0, 2.0])), [0.0, 0.0])
+    
+    def test_cache_invalidated_on_modify(self):
+        self.write_offsets([(0, 0, -1.0), (2, 0, -2.0), (0, 2, -3.0)])
+        interp2d = create_die_height_offset_interp2d(self.path)
+        self.assertIs(create_die_height_offset_interp2d(self.path), interp2d)
+        self.write_offsets([(0, 0, -5.0), (2, 0, -2.0), (0, 2, -3.0)])
+        mtime = os.path.getmtime(self.path) + 10.0
+        os.utime(self.path, (mtime, mtime))
+        interp2d_new = create_die_height_offset_interp2d(self.path)
+        self.assertIsNot(interp2d_new, interp2d)
+        self.assertAlmostEqual(interp2d_new(0, 0), -5.0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+"""
+Tests for misc utils.
+"""
+
+import unittest
+from controller.util import parse_keysight_str_values, into_sweep_range
+
+class TestParseKeysightStrValues(unittest.TestCase):
+    def test_parse_values(self):
+        vals = ["NCT+5.55189E+00", "NCI+0.00005E-09", "WHV-1.20000E+00", "NAI-0.00010E-09"]
+        self.assertEqual(parse_keysight_str_values(vals), [5.55189, 0.00005e-9, -1.2, -0.0001e-9])
+
+    def test_header_variants(self):
+        # no header, single char header, exponent without sign
+        vals = ["+1.5E+00", "T-2.0", "NAT+3E2", "WHV-4"]
+        self.assertEqual(parse_keysight_str_values(vals), [1.5, -2.0, 300.0, -4.0])
+
+    def test_returns_python_floats(self):
+        nums = parse_keysight_str_values(["NCT+1.0E+00", "NCI-2.0E-03"])
+        self.assertTrue(all(type(x) is float for x in nums))
+
+    def test_empty(self):
+        self.assertEqual(parse_keysight_str_values([]), [])
+
+    def test_missing_sign(self):
+        for vals in [["NCT1.0"], ["NCT+1.0", "NCI2.0"], ["NCI2.0", "NCT+1.0"]]:
+            with self.assertRaises(ValueError):
+                parse_keysight_str_values(vals)
+
+class TestIntoSweepRange(unittest.TestCase):
+    def test_formats(self):
+        self.assertEqual(into_sweep_range(1.5), [1.5])
+        self.assertEqual(into_sweep_range([1, 2]), [1, 2])
+        self.assertEqual(list(into_sweep_range({"start": 1.0, "stop": 0.0, "step": 0.25})), [1.0, 0.75, 0.5, 0.25, 0.0])
+        with self.assertRaises(ValueError):
+            into_sweep_range("1.0")
+
+    def test_dict_range_is_writable_copy(self):
+        v = {"start": 0.0, "stop": 1.0, "step": 0.5}
+        a = into_sweep_range(v)
+        a[0] = 9.0
+        self.assertEqual(list(into_sweep_range(v)), [0.0, 0.5, 1.0])
+
+if __name__ == '__main__':
+    unittest.main()